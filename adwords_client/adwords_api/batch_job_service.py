@@ -1,34 +1,154 @@
+import copy
+import http.client
 import logging
+import random
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from io import StringIO
+from threading import local
+from urllib.error import HTTPError
+from xml.etree import ElementTree
 
 import googleads
 
 from . import common as cm
+from .serializers import TemplateSerializer, build_range_request, build_status_request, build_upload_request
 from adwords_client.adwords_api.operations.utils import batch_job_operation
 from adwords_client.internal_api.builder import OperationsBuilder
 
 logger = logging.getLogger(__name__)
 
+STATUS_FIELDS = ['DownloadUrl', 'Id', 'ProcessingErrors', 'ProgressStats', 'Status']
+MAX_IDS_PER_STATUS_REQUEST = 500
+MAX_STATUS_WORKERS = 32
+# path to the id of the entities of batch job results, entities not listed here have it in their `id` field
+RESULT_ID_PATHS = {
+    'AdGroupAd': ('ad', 'id'),
+    'AdGroupCriterion': ('criterion', 'id'),
+    'Budget': ('budgetId',),
+    'CampaignCriterion': ('criterion', 'id'),
+}
+
+
+def _is_transient_error(error):
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def _local_name(element):
+    return element.tag.rpartition('}')[2]
+
+
+def _find_child(element, name):
+    for child in element:
+        if _local_name(child) == name:
+            return child
+    return None
+
+
+def _result_id(entity):
+    path = RESULT_ID_PATHS.get(_local_name(entity), ('id',))
+    for name in path:
+        entity = _find_child(entity, name)
+        if entity is None:
+            return None
+    return int(entity.text) if entity.text else None
+
+
+def _parse_mutate_result(element):
+    outcome = {'index': None, 'type': None, 'id': None, 'errors': []}
+    for child in element:
+        name = _local_name(child)
+        if name == 'index':
+            outcome['index'] = int(child.text)
+        elif name == 'result' and len(child):
+            entity = child[0]
+            outcome['type'] = _local_name(entity)
+            outcome['id'] = _result_id(entity)
+        elif name == 'errorList':
+            for error in child:
+                outcome['errors'].append({_local_name(field): field.text for field in error if not len(field)})
+    return outcome
+
+
+def iter_results(stream):
+    """
+    Parse the result XML of a batch job from a file like object, yielding a dict for every MutateResult
+
+    The dicts hold the `index` of the operation in the job, the `type` and `id` of the entity it created or
+    changed, and its `errors`. The document is parsed incrementally and every MutateResult is dropped once
+    parsed, so memory does not grow with the size of the results.
+    """
+    parent = None
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        name = _local_name(element)
+        if event == 'start':
+            if name == 'rval':
+                parent = element
+        elif name == 'MutateResult':
+            yield _parse_mutate_result(element)
+            try:
+                parent.remove(element)
+            except (AttributeError, ValueError):
+                element.clear()
+
+
+class OperationsSerializer:
+    """
+    XML of the operations of an upload increment, to be framed by `build_upload_request`.
+
+    Operations are rendered by TemplateSerializer. Chunks holding some operation it does not know are rendered by
+    the googleads request builder instead, without its framing. Both write the same namespace-less `operations`
+    elements, so increments of either kind can follow each other in the same upload.
+    """
+    def __init__(self, request_builder):
+        self.request_builder = request_builder
+        self.template_serializer = TemplateSerializer()
+
+    def serialize(self, operations):
+        operations_xml = self.template_serializer.serialize(operations)
+        if operations_xml is None:
+            operations_xml = self.request_builder._BuildUploadRequestBody(operations, has_prefix=False,
+                                                                         has_suffix=False)
+        return operations_xml
+
 
 class BatchJobHelper(googleads.adwords.BatchJobHelper):
+    max_retries = 5
+    retry_delay = 1
+    max_retry_delay = 60
 
-    def __init__(self, service):
+    def __init__(self, service, upload_helper_state=None):
         request_builder = self.GetRequestBuilder(client=service.client)
         response_parser = self.GetResponseParser()
         super().__init__(request_builder=request_builder, response_parser=response_parser)
+        self.request_builder = request_builder
+        self.operations_serializer = OperationsSerializer(request_builder)
         self.operations = OrderedDict()     # Should honor the operation type insertion order
+        self.origins = OrderedDict()
         self.last_operation = None
-        self.upload_helper = self.GetIncrementalUploadHelper(service.batch_job.result['value'][0].uploadUrl.url)
+        if upload_helper_state:
+            self.upload_helper = googleads.adwords.IncrementalUploadHelper.Load(upload_helper_state,
+                                                                              client=service.client)
+        else:
+            self.upload_helper = self.GetIncrementalUploadHelper(service.job['upload_url'])
+        # serialization runs ahead of the upload, so it keeps its own count of the bytes in the upload
+        self.serialized_length = self.upload_helper._current_content_length
         self._last_temporary_id = 0
 
     def __getitem__(self, op_type, item):
         return self.operations[op_type][item]
 
-    def add_operation(self, operation):
+    def add_operation(self, operation, origin=None):
         if operation['xsi_type'] in self.operations:
             self.operations[operation['xsi_type']].append(operation)
+            self.origins[operation['xsi_type']].append(origin)
         else:
             self.operations[operation['xsi_type']] = [operation]
+            self.origins[operation['xsi_type']] = [origin]
         self.last_operation = operation
 
     def get_temporary_id(self):
@@ -44,25 +164,160 @@ class BatchJobHelper(googleads.adwords.BatchJobHelper):
         self._last_temporary_id -= 1
         return self._last_temporary_id
 
-    def upload_operations(self, is_last=False):
-        fail_counter = 0
-        done = False
-        while not done:
+    def take_operations(self):
+        """
+        Remove the queued operations from the helper, grouped by operation type as expected by `serialize`
+        """
+        operations = list(self.operations.values())
+        self.operations = OrderedDict()
+        self.origins = OrderedDict()
+        self.last_operation = None
+        return operations
+
+    def take_origins(self):
+        """
+        Origins given to `add_operation` for the queued operations, in the order `take_operations` returns them
+        """
+        return list(chain.from_iterable(self.origins.values()))
+
+    def serialize(self, operations, is_last=False):
+        """
+        Build the upload request of the next increment of the upload.
+
+        Requests must be sent in the order they were serialized, but serializing does not wait for the previous
+        requests to be sent, so it can run ahead of the upload. Operations are rendered by `OperationsSerializer`.
+        """
+        return self.build_request(self.operations_serializer.serialize(operations), is_last)
+
+    def build_request(self, operations_xml, is_last=False):
+        """
+        Upload request of the next increment of the upload, for operations already rendered by `OperationsSerializer`
+        """
+        request = build_upload_request(self.upload_helper._upload_url, operations_xml,
+                                       current_content_length=self.serialized_length, is_last=is_last)
+        self.serialized_length += len(request.data)
+        return request
+
+    def _open(self, request):
+        try:
+            return self.upload_helper._url_opener.open(request)
+        except HTTPError as e:
+            # 308 (resume incomplete) is the expected answer for every increment but the last one
+            if e.code != 308:
+                raise
+            return e
+
+    def committed_length(self):
+        """
+        Number of bytes of the upload stored by the server, or None if the upload is already complete
+        """
+        response = self._open(build_status_request(self.upload_helper._upload_url))
+        if getattr(response, 'code', None) != 308:
+            return None
+        # the Range header holds the last stored byte, as in "bytes=0-262143"
+        stored_range = response.headers.get('Range')
+        return int(stored_range.rsplit('-', 1)[1]) + 1 if stored_range else 0
+
+    def send(self, request, is_last=False, check_committed=False):
+        """
+        Send a request built by `serialize`, retrying transient failures with capped exponential backoff.
+
+        A failed request may have been partly stored by the server, so before every retry the committed length of
+        the upload is queried and only the bytes the server is missing are sent again. With `check_committed` it is
+        also queried before the first attempt, for requests that may have been sent by an interrupted process.
+        """
+        if is_last:
+            logger.info('Uploading final data...')
+        else:
+            logger.info('Uploading intermediate data...')
+        data = request.data
+        start = self.upload_helper._current_content_length
+        end = start + len(data)
+        attempt = 0
+        while True:
             try:
-                if is_last:
-                    logger.info('Uploading final data...')
-                else:
-                    logger.info('Uploading intermediate data...')
-                self.upload_helper.UploadOperations(list(self.operations.values()), is_last=is_last)
-                self.operations = {}
-                self.last_operation = None
-                done = True
+                if attempt or check_committed:
+                    committed = self.committed_length()
+                    if committed is None or committed >= end:
+                        logger.info('Upload already stored by the server')
+                        break
+                    if committed < start:
+                        raise RuntimeError('Upload of batch job at {} lost data: {} bytes stored, {} expected'.format(
+                            self.upload_helper._upload_url, committed, start))
+                    if committed > start:
+                        logger.info('Resending upload from byte %d', committed)
+                        request = build_range_request(self.upload_helper._upload_url, data[committed - start:],
+                                                      committed, is_last)
+                self._open(request)
+                break
             except Exception as e:
-                fail_counter += 1
-                if fail_counter > 2:
+                attempt += 1
+                if attempt > self.max_retries or not _is_transient_error(e):
                     logger.error('Problem uploading the data, failure...')
-                    raise e
-                logger.error('Problem uploading the data, retrying...')
+                    raise
+                delay = random.uniform(0, min(self.max_retry_delay, self.retry_delay * 2 ** (attempt - 1)))
+                logger.warning('Problem uploading the data (%s), retrying in %.1fs...', e, delay)
+                time.sleep(delay)
+        self.upload_helper._current_content_length = end
+        self.upload_helper._is_last = is_last
+
+    def upload_operations(self, is_last=False):
+        self.send(self.serialize(self.take_operations(), is_last), is_last)
+
+    def dump_upload_helper(self):
+        """
+        Serialized state of the incremental upload, it can be given back to the constructor to resume the upload
+        """
+        output = StringIO()
+        self.upload_helper.Dump(output)
+        return output.getvalue()
+
+
+class ChunkSizer:
+    """
+    Number of operations to send in the next increment of an incremental upload.
+
+    Chunks aim at `target_bytes` of request body, estimated from the average serialized size of the operations
+    uploaded so far. The target is halved every time an upload takes longer than `max_latency` seconds and grows
+    by a quarter while uploads take less than half of it, always staying between `min_bytes` and `max_bytes`.
+    Every increment but the last is padded to a multiple of 256KB by the upload protocol, so smaller chunks only
+    waste bandwidth. `callback`, if given, is called with the number of operations, bytes and seconds of every
+    upload.
+    """
+    def __init__(self, initial_operations=5000, min_operations=100, max_operations=100000,
+                 target_bytes=4 * 1024 * 1024, min_bytes=256 * 1024, max_bytes=32 * 1024 * 1024, max_latency=60,
+                 callback=None):
+        self.initial_operations = initial_operations
+        self.min_operations = min_operations
+        self.max_operations = max_operations
+        self.target_bytes = target_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.callback = callback
+        self.bytes_per_operation = None
+
+    def next_size(self):
+        if not self.bytes_per_operation:
+            return self.initial_operations
+        size = int(self.target_bytes / self.bytes_per_operation)
+        return max(self.min_operations, min(self.max_operations, size))
+
+    def record_upload(self, number_of_operations, number_of_bytes, seconds):
+        if number_of_operations:
+            bytes_per_operation = number_of_bytes / number_of_operations
+            if self.bytes_per_operation:
+                # moving average, so a single odd chunk does not swing the size of the next ones
+                bytes_per_operation = 0.7 * self.bytes_per_operation + 0.3 * bytes_per_operation
+            self.bytes_per_operation = bytes_per_operation
+        if seconds > self.max_latency:
+            self.target_bytes = max(self.min_bytes, self.target_bytes // 2)
+        elif seconds < self.max_latency / 2:
+            self.target_bytes = min(self.max_bytes, self.target_bytes + self.target_bytes // 4)
+        logger.debug('Uploaded %d operations (%d bytes) in %.1fs, next chunk target is %d bytes',
+                     number_of_operations, number_of_bytes, seconds, self.target_bytes)
+        if self.callback:
+            self.callback(number_of_operations, number_of_bytes, seconds)
 
 
 class BatchJobOperations:
@@ -80,7 +335,19 @@ class BatchJobService(cm.BaseService):
     def __init__(self, client):
         super().__init__(client, 'BatchJobService')
         self.batch_job = None
+        self.job = None
         self.helper = None
+        self._local = local()
+        self._operations_serializer = None
+
+    @property
+    def operations_serializer(self):
+        """
+        OperationsSerializer for the uploads of this service, it does not depend on any job
+        """
+        if not self._operations_serializer:
+            self._operations_serializer = OperationsSerializer(BatchJobHelper.GetRequestBuilder(client=self.client))
+        return self._operations_serializer
 
     def get_wholeoperation_id(self):
         try:
@@ -97,8 +364,20 @@ class BatchJobService(cm.BaseService):
         self.helper.add_batch_job_operation('ADD')
         self.batch_job = self.mutate(client_customer_id)
         logger.info('Created new batchjob:\n%s', self.batch_job)
+        batch_job = self.batch_job.result['value'][0]
+        self.job = {'id': batch_job.id, 'upload_url': batch_job.uploadUrl.url, 'status': batch_job.status}
         self.helper = BatchJobHelper(self)
 
+    def resume_job(self, job, upload_helper_state, client_customer_id=None):
+        """
+        Continue the incremental upload of a job created by `prepare_job` (`job` is the `self.job` dict of that call)
+        """
+        if client_customer_id:
+            self.client.SetClientCustomerId(client_customer_id)
+        self.job = job
+        logger.info('Resuming batchjob %s', job['id'])
+        self.helper = BatchJobHelper(self, upload_helper_state)
+
     def cancel_jobs(self, jobs, client_id=None):
         self.prepare_mutate()
         for job in jobs:
@@ -106,32 +385,51 @@ class BatchJobService(cm.BaseService):
                 self.helper.add_batch_job_operation('SET', job['id'], 'CANCELING')
         return self.mutate(client_id) if len(self.helper.operations) > 0 else None
 
-    def get_status(self, batch_job_id, client_customer_id=None):
-
+    def _get_status_operation(self, client_id, batch_job_ids):
         internal_operation = {
             'object_type': 'batch_job',
-            'client_id': 7857288943,
-            'fields': ['DownloadUrl', 'Id', 'ProcessingErrors', 'ProgressStats', 'Status'],
-            'predicates': [('Id', 'EQUALS', [batch_job_id])]
+            'fields': STATUS_FIELDS,
+            'predicates': [('Id', 'IN', batch_job_ids)]
         }
+        if client_id:
+            internal_operation['client_id'] = client_id
         adwords_operation_builder = OperationsBuilder()
-        adwords_operation = adwords_operation_builder(internal_operation)
+        return adwords_operation_builder(internal_operation)
 
+    def get_status(self, batch_job_id, client_customer_id=None):
+        adwords_operation = self._get_status_operation(client_customer_id, [batch_job_id])
         return next(iter(self.get(adwords_operation, client_customer_id)))
 
-    def get_multiple_status(self, jobs):
-        result = {}
-        for client_id in jobs:
+    def _thread_service(self):
+        """
+        BatchJobService with a copy of the client for the calling thread, so requests for different accounts can
+        run concurrently (the customer id is set on it per request)
+        """
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = BatchJobService(copy.copy(self.client))
+        return service
 
-            internal_operation = {
-                'object_type': 'batch_job',
-                'client_id': 7857288943,
-                'fields': ['DownloadUrl', 'Id', 'ProcessingErrors', 'ProgressStats', 'Status'],
-                'predicates': [('Id', 'IN', [job for job in jobs[client_id]])]
-            }
+    def _get_statuses(self, task):
+        client_id, batch_job_ids = task
+        adwords_operation = self._get_status_operation(client_id, batch_job_ids)
+        return client_id, list(self._thread_service().get(adwords_operation, client_id))
 
-            adwords_operation_builder = OperationsBuilder()
-            adwords_operation = adwords_operation_builder(internal_operation)
-            result[client_id] = list(self.get(adwords_operation, client_id))
+    def get_multiple_status(self, jobs, max_workers=None, ids_per_request=MAX_IDS_PER_STATUS_REQUEST):
+        """
+        Status of the batch jobs in `jobs` (a dict of client_id: batch job ids), as a dict of client_id: statuses
+
+        Accounts are queried concurrently, with at most `ids_per_request` job ids in each request.
+        """
+        tasks = []
+        for client_id in jobs:
+            batch_job_ids = list(jobs[client_id])
+            for i in range(0, len(batch_job_ids), ids_per_request):
+                tasks.append((client_id, batch_job_ids[i:i + ids_per_request]))
+        result = {client_id: [] for client_id in jobs}
+        if tasks:
+            with ThreadPoolExecutor(max_workers or min(MAX_STATUS_WORKERS, len(tasks))) as executor:
+                for client_id, statuses in executor.map(self._get_statuses, tasks):
+                    result[client_id].extend(statuses)
         logger.info('BatchJob Statuses:\n%s', result)
         return result
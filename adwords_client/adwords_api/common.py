@@ -1,5 +1,7 @@
+import http.client
 import requests
 import logging
+import random
 from functools import lru_cache
 import time
 
@@ -42,6 +44,153 @@ def get_report_csv(report_type):
     return requests.get(csv_url).content.decode('utf-8')
 
 
+def _api_error_type_reason(api_error):
+    """
+    (type, reason) of an ApiError
+    """
+    try:
+        error_type = api_error['ApiError.Type']
+    except (KeyError, TypeError, AttributeError):
+        error_type = type(api_error).__name__
+    try:
+        reason = api_error['reason']
+    except (KeyError, TypeError, AttributeError):
+        reason = None
+    return error_type, reason
+
+
+def _api_errors(error):
+    """
+    ApiErrors of a googleads server fault
+    """
+    return list(getattr(error, 'errors', None) or [])
+
+
+def describe_api_error(api_error):
+    """
+    JSON serializable summary of an ApiError
+    """
+    error_type, reason = _api_error_type_reason(api_error)
+    description = {'type': str(error_type), 'reason': None if reason is None else str(reason)}
+    for field, key in (('fieldPath', 'field_path'), ('trigger', 'trigger'), ('errorString', 'error_string')):
+        try:
+            value = api_error[field]
+        except (KeyError, TypeError, AttributeError):
+            value = None
+        description[key] = None if value is None else str(value)
+    return description
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed API call is tried again, and after how long.
+
+    Errors are classified as:
+    - RATE_EXCEEDED: a RateExceededError, retried after the retryAfterSeconds given by the server (or
+      `rate_exceeded_delay`) plus up to `base_delay` seconds of jitter;
+    - TRANSIENT: transport errors and ApiErrors with a reason in `transient_reasons`, retried with capped
+      exponential backoff with full jitter;
+    - PERMANENT: anything else, raised right away.
+    The same rules apply to operations resent after failing in a partial failure (see `get_resend_delay`).
+    Subclasses can change the classification by overriding `classify`.
+    """
+    PERMANENT = 'permanent'
+    TRANSIENT = 'transient'
+    RATE_EXCEEDED = 'rate_exceeded'
+
+    transient_reasons = {'UNEXPECTED_INTERNAL_API_ERROR', 'TRANSIENT_ERROR', 'CONCURRENT_MODIFICATION'}
+    transient_exceptions = (OSError, http.client.HTTPException, requests.exceptions.RequestException)
+
+    def __init__(self, max_attempts=4, base_delay=1, max_delay=120, rate_exceeded_delay=30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_exceeded_delay = rate_exceeded_delay
+
+    def _classify_api_error(self, error_type, reason):
+        if error_type == 'RateExceededError' or reason == 'RATE_EXCEEDED':
+            return self.RATE_EXCEEDED
+        if reason in self.transient_reasons:
+            return self.TRANSIENT
+        return self.PERMANENT
+
+    def _classify_api_errors(self, api_errors):
+        kinds = {self._classify_api_error(*_api_error_type_reason(api_error)) for api_error in api_errors}
+        if self.RATE_EXCEEDED in kinds:
+            return self.RATE_EXCEEDED
+        if kinds == {self.TRANSIENT}:
+            return self.TRANSIENT
+        return self.PERMANENT
+
+    def is_retryable(self, api_error):
+        """
+        Whether the operation that caused `api_error` (an ApiError of a partial failure) may succeed if sent again
+        """
+        return self._classify_api_error(*_api_error_type_reason(api_error)) != self.PERMANENT
+
+    def classify(self, error):
+        api_errors = _api_errors(error)
+        if api_errors:
+            return self._classify_api_errors(api_errors)
+        if isinstance(error, self.transient_exceptions):
+            return self.TRANSIENT
+        # zeep transport errors carry the HTTP status of the failed request
+        status_code = getattr(error, 'status_code', None)
+        if isinstance(status_code, int) and (status_code >= 500 or status_code == 429):
+            return self.TRANSIENT
+        return self.PERMANENT
+
+    def _retry_after(self, api_errors):
+        for api_error in api_errors:
+            try:
+                retry_after = api_error['retryAfterSeconds']
+            except (KeyError, TypeError, AttributeError):
+                continue
+            if retry_after:
+                return retry_after
+        return self.rate_exceeded_delay
+
+    def _delay(self, kind, api_errors, attempt):
+        if attempt >= self.max_attempts:
+            return None
+        if kind == self.RATE_EXCEEDED:
+            return self._retry_after(api_errors) + random.uniform(0, self.base_delay)
+        if kind == self.TRANSIENT:
+            return self.backoff(attempt)
+        return None
+
+    def get_delay(self, error, attempt):
+        """
+        Seconds to wait before the attempt after `attempt` (starting at 1), or None if the error must be raised
+        """
+        return self._delay(self.classify(error), _api_errors(error), attempt)
+
+    def get_resend_delay(self, api_errors, attempt):
+        """
+        Seconds to wait before sending again, for the attempt after `attempt`, operations of a partial failure that
+        failed with `api_errors`, or None if they must not be sent again
+        """
+        return self._delay(self._classify_api_errors(api_errors), api_errors, attempt)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, function, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self.get_delay(e, attempt)
+                if delay is None:
+                    logger.error('API call failed after %d attempts (%s error)', attempt, self.classify(e))
+                    raise
+                logger.warning('API call failed (%s error), retrying in %.1fs for the %d time...',
+                               self.classify(e), delay, attempt)
+                time.sleep(delay)
+
+
 class BaseResult:
     def __init__(self, callback, parameters):
         self.callback = callback
@@ -58,8 +207,9 @@ class BaseResult:
 
 
 class SyncReturnValue(BaseResult):
-    def __init__(self, callback, parameters):
+    def __init__(self, callback, parameters, retry_policy=None):
         super().__init__(callback, parameters)
+        self.retry_policy = retry_policy or RetryPolicy()
         label_operations = [adw_op for adw_op in parameters if 'labelId' in adw_op['operand']]
         regular_operations = [adw_op for adw_op in parameters if 'labelId' not in adw_op['operand']]
 
@@ -72,20 +222,7 @@ class SyncReturnValue(BaseResult):
 
 
     def _upload_sync_operations(self, callback, operations):
-        fail_counter = 0
-        done = False
-        while not done:
-            try:
-                results = callback(operations)
-                done = True
-                return results
-            except Exception as e:
-                fail_counter += 1
-                time.sleep(fail_counter*60)
-                if fail_counter > 3:
-                    logger.error('Problem sync uploading the data, failure...')
-                    raise e
-                logger.error('Problem sync uploading the data, retrying for the %s time...', fail_counter)
+        return self.retry_policy.call(callback, operations)
 
     def get_errors(self):
         if self.result and 'partialFailureErrors' in self.result:
@@ -132,7 +269,6 @@ class PagedResult(BaseResult):
                 for entry in result['entries']:
                     yield entry
         self._reset()
-        raise StopIteration
 
 
 class BaseService:
@@ -142,6 +278,7 @@ class BaseService:
         self._service = None
         self.helper = None
         self.ResultProcessor = None
+        self.retry_policy = None
 
     @property
     def service(self):
@@ -171,7 +308,7 @@ class BaseService:
         if client_customer_id:
             self.client.SetClientCustomerId(client_customer_id)
         if sync:
-            return self.ResultProcessor(self.service, self.helper.operations)
+            return self.ResultProcessor(self.service, self.helper.operations, retry_policy=self.retry_policy)
         return self.ResultProcessor(self.service.mutate, self.helper.operations)
 
 
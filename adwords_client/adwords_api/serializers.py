@@ -0,0 +1,201 @@
+import logging
+import urllib.request
+from xml.sax.saxutils import escape
+
+from .common import API_VERSION
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'https://adwords.google.com/api/adwords/cm/{}'.format(API_VERSION)
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+# the framing of googleads' upload requests, the operations elements of both serializers rely on its namespaces
+UPLOAD_PREFIX = '<?xml version="1.0" encoding="UTF-8"?>\n<mutate xmlns="{}" xmlns:xsi="{}">'.format(NAMESPACE,
+                                                                                               XSI_NAMESPACE)
+UPLOAD_SUFFIX = '</mutate>'
+# every increment of an upload but the last one must be a multiple of this size
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+_OPERATION = ('operator', 'operand')
+_CRITERION = ('id', 'type')
+_AD = ('id', 'url', 'displayUrl', 'finalUrls', 'finalMobileUrls', 'finalAppUrls', 'trackingUrlTemplate',
+       'finalUrlSuffix', 'urlCustomParameters', 'urlData', 'automated', 'type', 'devicePreference')
+
+# Element order of the API types built in adwords_api/operations (inherited fields first). SOAP requires the
+# elements of a type to follow the order of its schema sequence, so only these types can use the templates.
+TYPE_FIELDS = {
+    'AdGroupCriterionOperation': _OPERATION,
+    'AdGroupOperation': _OPERATION,
+    'AdGroupAdOperation': _OPERATION,
+    'BudgetOperation': _OPERATION,
+    'CampaignOperation': _OPERATION,
+    'CampaignCriterionOperation': _OPERATION,
+    'BiddableAdGroupCriterion': ('adGroupId', 'criterionUse', 'criterion', 'labels', 'baseCampaignId',
+                                 'baseAdGroupId', 'userStatus', 'systemServingStatus', 'approvalStatus',
+                                 'disapprovalReasons', 'firstPageCpc', 'topOfPageCpc', 'firstPositionCpc',
+                                 'qualityInfo', 'biddingStrategyConfiguration', 'bidModifier', 'finalUrls',
+                                 'finalMobileUrls', 'finalAppUrls', 'trackingUrlTemplate', 'finalUrlSuffix',
+                                 'urlCustomParameters'),
+    'Keyword': _CRITERION + ('text', 'matchType'),
+    'Language': _CRITERION + ('code', 'name'),
+    'Location': _CRITERION + ('locationName', 'displayType', 'targetingStatus', 'parentLocations'),
+    'AdSchedule': _CRITERION + ('dayOfWeek', 'startHour', 'startMinute', 'endHour', 'endMinute'),
+    'BiddingStrategyConfiguration': ('biddingStrategyId', 'biddingStrategyName', 'biddingStrategyType',
+                                     'biddingStrategySource', 'biddingScheme', 'bids', 'targetRoasOverride'),
+    'CpcBid': ('bid', 'cpcBidSource'),
+    'Money': ('microAmount',),
+    'AdGroup': ('id', 'campaignId', 'campaignName', 'name', 'status', 'settings', 'labels',
+                'biddingStrategyConfiguration', 'contentBidCriterionTypeGroup', 'baseCampaignId', 'baseAdGroupId',
+                'trackingUrlTemplate', 'finalUrlSuffix', 'urlCustomParameters', 'adGroupType',
+                'adGroupAdRotationMode'),
+    'AdGroupAd': ('adGroupId', 'ad', 'status', 'policySummary', 'labels', 'baseCampaignId', 'baseAdGroupId'),
+    'Ad': _AD,
+    'ExpandedTextAd': _AD + ('headlinePart1', 'headlinePart2', 'headlinePart3', 'description', 'description2',
+                             'path1', 'path2'),
+    'CustomParameters': ('parameters', 'doReplace'),
+    'CustomParameter': ('key', 'value', 'isRemove'),
+    'Campaign': ('id', 'name', 'status', 'servingStatus', 'startDate', 'endDate', 'budget',
+                 'conversionOptimizerEligibility', 'adServingOptimizationStatus', 'frequencyCap', 'settings',
+                 'advertisingChannelType', 'advertisingChannelSubType', 'networkSetting', 'labels',
+                 'biddingStrategyConfiguration', 'campaignGroupId', 'forwardCompatibilityMap', 'trackingUrlTemplate',
+                 'finalUrlSuffix', 'urlCustomParameters'),
+    'NetworkSetting': ('targetGoogleSearch', 'targetSearchNetwork', 'targetContentNetwork',
+                       'targetPartnerSearchNetwork'),
+    'GeoTargetTypeSetting': ('positiveGeoTargetType', 'negativeGeoTargetType'),
+    'Budget': ('budgetId', 'name', 'amount', 'deliveryMethod', 'referenceCount', 'isExplicitlyShared', 'status'),
+    'CampaignCriterion': ('campaignId', 'isNegative', 'criterion', 'bidModifier', 'forwardCompatibilityMap',
+                          'baseCampaignId'),
+}
+
+# Type of the fields that hold objects without an explicit xsi_type
+FIELD_TYPES = {
+    'amount': 'Money',
+    'bid': 'Money',
+    'budget': 'Budget',
+    'networkSetting': 'NetworkSetting',
+    'parameters': 'CustomParameter',
+    'urlCustomParameters': 'CustomParameters',
+}
+
+
+class UnsupportedOperation(Exception):
+    pass
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return escape(value)
+    return str(value)
+
+
+class TemplateSerializer:
+    """
+    Serializes batch job operations straight to XML, without going through the SOAP library.
+
+    A writer function is compiled once per API type from TYPE_FIELDS, with the element tags already rendered, so
+    serializing an operation is a walk over its dict appending strings. `serialize` returns None if some
+    operation has a type or a field that is not in TYPE_FIELDS, so the generic request builder can be used instead.
+    """
+    def __init__(self):
+        self.writers = {}
+
+    def _compile(self, type_name):
+        try:
+            fields = TYPE_FIELDS[type_name]
+        except KeyError:
+            raise UnsupportedOperation(type_name)
+        known_fields = frozenset(fields).union(['xsi_type'])
+        specs = [('<{}>'.format(field), '<{} xsi:type="'.format(field), '</{}>'.format(field), field,
+                  FIELD_TYPES.get(field))
+                 for field in fields]
+        get_writer = self.get_writer
+
+        def write(value, parts):
+            if not known_fields.issuperset(value):
+                raise UnsupportedOperation('{}: {}'.format(type_name, ', '.join(set(value) - known_fields)))
+            for open_tag, typed_open_tag, close_tag, field, field_type in specs:
+                items = value.get(field)
+                if items is None:
+                    continue
+                if not isinstance(items, list):
+                    items = (items,)
+                for item in items:
+                    if isinstance(item, dict):
+                        xsi_type = item.get('xsi_type')
+                        if xsi_type:
+                            parts.append(typed_open_tag + xsi_type + '">')
+                        else:
+                            parts.append(open_tag)
+                        get_writer(xsi_type or field_type)(item, parts)
+                    elif item is not None:
+                        parts.append(open_tag)
+                        parts.append(_format_value(item))
+                    else:
+                        continue
+                    parts.append(close_tag)
+
+        return write
+
+    def get_writer(self, type_name):
+        writer = self.writers.get(type_name)
+        if writer is None:
+            writer = self.writers[type_name] = self._compile(type_name)
+        return writer
+
+    def serialize(self, operations):
+        """
+        XML of the `operations` elements of a mutate request, `operations` being a list of lists of operations.
+
+        Elements are written without namespace declarations, as googleads writes them, and take the namespaces
+        declared by UPLOAD_PREFIX.
+        """
+        parts = []
+        try:
+            for operations_of_type in operations:
+                for operation in operations_of_type:
+                    xsi_type = operation['xsi_type']
+                    parts.append('<operations xsi:type="{}">'.format(xsi_type))
+                    self.get_writer(xsi_type)(operation, parts)
+                    parts.append('</operations>')
+        except UnsupportedOperation as e:
+            logger.debug('Falling back to the generic serializer, unsupported operation: %s', e)
+            return None
+        return ''.join(parts)
+
+
+def build_range_request(upload_url, data, start, is_last=False):
+    """
+    PUT of the bytes of an incremental upload beginning at offset `start`
+    """
+    end = start + len(data)
+    request = urllib.request.Request(upload_url, data=data, method='PUT')
+    request.add_header('Content-Type', 'application/xml')
+    request.add_header('Content-Length', str(len(data)))
+    request.add_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, end if is_last else '*'))
+    return request
+
+
+def build_upload_request(upload_url, operations_xml, current_content_length=0, is_last=False):
+    """
+    Request for one increment of a batch job incremental upload, as sent by googleads' IncrementalUploadHelper.
+    `operations_xml` can also be given already encoded as UTF-8.
+    """
+    data = operations_xml if isinstance(operations_xml, bytes) else operations_xml.encode('utf-8')
+    if current_content_length == 0:
+        data = UPLOAD_PREFIX.encode('utf-8') + data
+    if is_last:
+        data += UPLOAD_SUFFIX.encode('utf-8')
+    if not is_last:
+        data += b' ' * (-len(data) % UPLOAD_CHUNK_SIZE)
+    return build_range_request(upload_url, data, current_content_length, is_last)
+
+
+def build_status_request(upload_url):
+    """
+    Empty PUT asking how many bytes of an incremental upload the server has stored
+    """
+    request = urllib.request.Request(upload_url, data=b'', method='PUT')
+    request.add_header('Content-Length', '0')
+    request.add_header('Content-Range', 'bytes */*')
+    return request
@@ -0,0 +1,141 @@
+import io
+import json
+import logging
+import marshal
+import struct
+from collections.abc import Mapping
+from tempfile import NamedTemporaryFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+
+
+def _to_builtin(value):
+    if isinstance(value, Mapping):
+        return {k: _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(item) for item in value]
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return value.item()
+    return value
+
+
+class JsonCodec:
+    """
+    Newline delimited JSON records
+    """
+    read_mode = 'r'
+    write_mode = 'w+'
+    empty = ''
+
+    def encode(self, entry):
+        return json.dumps(entry) + '\n'
+
+    def iter_decode(self, file):
+        for line in file:
+            yield json.loads(line)
+
+
+class MarshalCodec:
+    """
+    Length prefixed marshal records
+
+    Every record is a 4 bytes little endian length followed by the marshalled entry, which is several times
+    cheaper to encode and decode than JSON text. Entries holding non builtin types (OrderedDict, numpy scalars)
+    are converted to builtin ones before being marshalled.
+    """
+    read_mode = 'rb'
+    write_mode = 'w+b'
+    empty = b''
+    header = struct.Struct('<I')
+
+    def encode(self, entry):
+        try:
+            data = marshal.dumps(entry)
+        except ValueError:
+            data = marshal.dumps(_to_builtin(entry))
+        return self.header.pack(len(data)) + data
+
+    def iter_decode(self, file):
+        read = file.read
+        unpack = self.header.unpack
+        header_size = self.header.size
+        header = read(header_size)
+        while header:
+            size, = unpack(header)
+            yield marshal.loads(read(size))
+            header = read(header_size)
+
+
+JSON_CODEC = JsonCodec()
+
+
+def detect_codec(first_line, default):
+    """
+    Codec of a file whose first line (as bytes) is `first_line`: JSON_CODEC if it holds a JSON record, else `default`
+    """
+    if first_line.startswith(b'{'):
+        try:
+            json.loads(first_line.decode('utf-8'))
+        except ValueError:
+            return default
+        return JSON_CODEC
+    return default
+
+
+class OperationsBuffer:
+    """
+    Buffer holding the entries passed to AdWords.insert, encoded with the given codec
+
+    Records are kept in memory until they add up to `spill_threshold` bytes. Past that point they are moved to
+    a temporary file and every following record is written there.
+    """
+    def __init__(self, codec=None, spill_threshold=DEFAULT_SPILL_THRESHOLD):
+        self.codec = codec or MarshalCodec()
+        self.spill_threshold = spill_threshold
+        self.records = []
+        self.size = 0
+        self.file = None
+
+    def _spill(self):
+        self.file = NamedTemporaryFile(self.codec.write_mode)
+        logger.debug('Spilled buffer to temporary file %s', self.file.name)
+        self.file.write(self.codec.empty.join(self.records))
+        self.records = None
+
+    def _write_data(self, data):
+        if self.file:
+            self.file.write(data)
+        else:
+            self.records.append(data)
+            self.size += len(data)
+            if self.size > self.spill_threshold:
+                self._spill()
+
+    def write(self, entry):
+        self._write_data(self.codec.encode(entry))
+
+    def write_many(self, entries):
+        self._write_data(self.codec.empty.join(map(self.codec.encode, entries)))
+
+    def __iter__(self):
+        if self.file:
+            self.file.flush()
+            self.file.seek(0)
+            yield from self.codec.iter_decode(self.file)
+        else:
+            data = self.codec.empty.join(self.records)
+            self.records = [data]
+            stream = io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data)
+            yield from self.codec.iter_decode(stream)
+
+    @property
+    def in_memory(self):
+        return self.file is None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        self.records = None
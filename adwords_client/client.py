@@ -1,29 +1,87 @@
 import csv
 import datetime
+import heapq
 import inspect
 import json
 import logging
 import time
+import timeit
 import uuid
+import requests
 import yaml
-from collections import Mapping
+from array import array
+from bisect import bisect_right
+from collections import Mapping, OrderedDict
 from threading import local
 from io import StringIO
+from itertools import chain, groupby, islice
 from math import floor, isfinite
+from operator import itemgetter
 from multiprocessing import Pool
 from os import path
-from tempfile import NamedTemporaryFile
 from concurrent.futures import ThreadPoolExecutor
 
 import googleads.adwords
 
-from . import adwords_api, config, storages, utils
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import adwords_api, buffers, config, storages, utils
 from .adwords_api import common
+from .adwords_api.batch_job_service import ChunkSizer, iter_results
 from .internal_api.builder import OperationsBuilder
 from .internal_api.mappers import MAPPERS
 
 logger = logging.getLogger(__name__)
 
+# Parent objects must be created before their children for temporary ids to resolve.
+OBJECT_TYPE_LEVELS = {
+    'customer': 0,
+    'managed_customer': 0,
+    'billing_account': 0,
+    'budget_order': 0,
+    'label': 0,
+    'account_label': 0,
+    'shared_set': 0,
+    'campaign': 1,  # budgets are created along with their campaign
+    'shared_criterion': 1,
+    'adgroup': 2,
+    'campaign_shared_set': 2,
+    'campaign_ad_schedule': 2,
+    'campaign_targeted_location': 2,
+    'campaign_language': 2,
+    'campaign_sitelink': 2,
+    'campaign_callout': 2,
+    'campaign_structured_snippet': 2,
+    'ad': 3,
+    'keyword': 3,
+    'attach_label': 4,
+}
+UNKNOWN_OBJECT_TYPE_LEVEL = max(OBJECT_TYPE_LEVELS.values()) + 1
+
+# Entry field holding the id of the entities of batch job results, used to map temporary ids to real ids
+RESULT_ID_FIELDS = {
+    'Campaign': 'campaign_id',
+    'Budget': 'budget_id',
+    'AdGroup': 'adgroup_id',
+    'AdGroupAd': 'ad_id',
+    'AdGroupCriterion': 'criteria_id',
+}
+TEMPORARY_ID_FIELDS = sorted(set(RESULT_ID_FIELDS.values()))
+# field of the id of the entity created by an ADD entry of each object type
+OWN_ID_FIELDS = {
+    'campaign': 'campaign_id',
+    'adgroup': 'adgroup_id',
+    'ad': 'ad_id',
+    'keyword': 'criteria_id',
+}
+# bytes of an operations file read to tell its codec
+MAX_RECORD_SNIFF = 1024 * 1024
+# groups mutated at the same time by _sync_operations, unless told otherwise
+MAX_SYNC_WORKERS = 8
+
 
 def _iter_floats(data):
     for item in data:
@@ -44,6 +102,122 @@ def _get_dict_min_value(data):
         raise
 
 
+def _get_column_min_value(column):
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        if column.dtype.kind in 'iu':
+            return int(column.min()) if column.size else 0
+        if column.dtype.kind == 'f':
+            column = column[numpy.isfinite(column)]
+            return int(floor(column.min())) if column.size else 0
+    elif isinstance(column, array) and column.typecode not in 'fdu':
+        return min(column, default=0)
+    return min((int(floor(value)) for value in _iter_floats(column)), default=0)
+
+
+def _is_temporary_id(value):
+    return isinstance(value, int) and value < 0
+
+
+def _parent_id_fields(entry):
+    """
+    Temporary id fields of `entry` that refer to other entities, the id of the entity created by an ADD is not one
+    """
+    if str(entry.get('operator', 'ADD')).upper() == 'ADD':
+        own_field = OWN_ID_FIELDS.get(entry.get('object_type'))
+        return [field for field in TEMPORARY_ID_FIELDS if field != own_field]
+    return TEMPORARY_ID_FIELDS
+
+
+def _get_sort_key(entry, position):
+    level = OBJECT_TYPE_LEVELS.get(entry.get('object_type'), UNKNOWN_OBJECT_TYPE_LEVEL)
+    return str(entry['client_id']), level, position
+
+
+def _parse_creation_time(creation_time):
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(creation_time, time_format).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class _ReportRows:
+    """
+    Rows of a streamed report. The report is closed once the rows are exhausted, on errors and on `close()`,
+    even if no row was read yet.
+    """
+    def __init__(self, raw_report, rows):
+        self.raw_report = raw_report
+        self.rows = rows()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.rows)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.rows.close()
+        self.raw_report.close()
+
+
+class JobPollScheduler:
+    """
+    Seconds to wait before polling pending batch jobs again
+
+    The completion time of every job is extrapolated from the `estimated_percent_executed` recorded by
+    `_update_jobs_status`, at the rate the job progressed since it was first seen running (or since its creation
+    time, before a second observation exists). Polls are scheduled at the earliest estimated completion, bounded
+    by `min_sleep` and `max_sleep`. Jobs without progress yet are polled with exponential backoff from `min_sleep`.
+    """
+    def __init__(self, min_sleep=15, max_sleep=600):
+        self.min_sleep = min_sleep
+        self.max_sleep = max_sleep
+        self.first_progress = {}
+        self.idle_polls = 0
+
+    def estimate_remaining(self, job, now=None):
+        now = now or time.time()
+        percent = job.get('estimated_percent_executed')
+        if not percent:
+            return None
+        first_time, first_percent = self.first_progress.setdefault(job['batchjob_id'], (now, percent))
+        if first_time == now or percent <= first_percent:
+            first_time, first_percent = _parse_creation_time(job.get('creation_time')), 0
+            if first_time is None:
+                return None
+        return (100 - percent) * (now - first_time) / (percent - first_percent)
+
+    def next_sleep(self, pending_jobs, now=None):
+        now = now or time.time()
+        estimates = []
+        idle = False
+        for client_jobs in pending_jobs.values():
+            for job in client_jobs.values():
+                remaining = self.estimate_remaining(job, now)
+                if remaining is None:
+                    idle = True
+                else:
+                    estimates.append(remaining)
+        if idle:
+            estimates.append(self.min_sleep * 2 ** self.idle_polls)
+            self.idle_polls += 1
+        else:
+            self.idle_polls = 0
+        return max(self.min_sleep, min(self.max_sleep, min(estimates, default=self.min_sleep)))
+
+
 def adwords_client_factory(credentials):
     config = {'adwords': credentials}
     config_yaml = yaml.safe_dump(config)
@@ -51,20 +225,112 @@ def adwords_client_factory(credentials):
 
 
 def multiprocessing_map(*args, **kwargs):
-    return Pool().map(*args, **kwargs)
+    with Pool() as pool:
+        return pool.map(*args, **kwargs)
+
+
+# AdWords instance of a worker process of AdWords.pool, it lives as long as the process
+_worker = None
+
+
+def _init_worker(adwords):
+    global _worker
+    _worker = adwords
+
+
+def _call_worker(task):
+    method_name, min_id, argument = task
+    _worker.min_id = min_id
+    return getattr(_worker, method_name)(argument)
 
 
 class AdWords:
-    def __init__(self, workdir=None, storage=None, map_function=None, **kwargs):
-        self.map_function = map_function or multiprocessing_map
+    def __init__(self, workdir=None, storage=None, map_function=None, pool_size=None, use_threads=False,
+                 use_pool=False, max_threads=None, max_open_files=256, max_pending_writes=10000, codec=None,
+                 spill_threshold=buffers.DEFAULT_SPILL_THRESHOLD, chunk_size_hook=None, id_mapping_path=None,
+                 retry_policy=None, **kwargs):
+        self.map_function = map_function
+        self.pool_size = pool_size
+        self.use_threads = use_threads
+        self.use_pool = use_pool
+        self.max_threads = max_threads
+        self.chunk_size_hook = chunk_size_hook
+        self._pool = None
+        self._thread_pool = None
+        self.codec = codec or buffers.MarshalCodec()
+        self.spill_threshold = spill_threshold
+        self.max_open_files = max_open_files
+        self.max_pending_writes = max_pending_writes
         if storage:
             self.storage = storage
         else:
             self.storage = storages.FilesystemStorage(workdir) if workdir else storages.TemporaryFilesystemStorage()
         self.extra_options = kwargs
+        self.id_mapping_path = id_mapping_path
+        self.retry_policy = retry_policy
+        self._id_mapping = None
         self.min_id = 0
         self._reset()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # thread locals, buffers and pools can not be sent to other processes
+        state.update(_local=None, _operations_buffer=None, _pool=None, _thread_pool=None)
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._thread_pool:
+            self._thread_pool.shutdown()
+            self._thread_pool = None
+
+    @property
+    def pool(self):
+        if not self._pool:
+            self._pool = Pool(self.pool_size, initializer=_init_worker, initargs=(self,))
+        return self._pool
+
+    def pool_map(self, method, iterable):
+        """
+        Map a method of this object over `iterable` using the worker processes owned by this object.
+
+        Each worker keeps its own copy of this object for as long as the pool lives, so googleads clients and
+        services cached in `local` are reused by every following call. The pool lives until `close()` is called,
+        which happens automatically when the object is used as a context manager.
+
+        The copies are made when the pool is created: options changed later (storage, hooks, retry_policy...) only
+        reach the workers after `close()`. This is why `execute_operations` only uses it with `use_pool=True`.
+        """
+        tasks = [(method.__name__, self.min_id, item) for item in iterable]
+        return self.pool.map(_call_worker, tasks, chunksize=1)
+
+    @property
+    def thread_pool(self):
+        if not self._thread_pool:
+            self._thread_pool = ThreadPoolExecutor(self.max_threads)
+        return self._thread_pool
+
+    def thread_map(self, method, iterable):
+        """
+        Map a method of this object over `iterable` using the threads owned by this object.
+
+        Batch uploads mostly wait on HTTP, so one process can drive dozens of them. Each thread caches its own
+        googleads client and services in `local`, which are reused by every following call. There are up to
+        `max_threads` threads (ThreadPoolExecutor's default if not given), `pool_size` is the number of processes.
+        """
+        # the thread local must exist before the threads race to create it
+        self._local = self._local or local()
+        return list(self.thread_pool.map(method, iterable))
+
     def _reset(self):
         self._local = None
         self._operations_buffer = None
@@ -93,8 +359,7 @@ class AdWords:
     @property
     def operations(self):
         if not self._operations_buffer:
-            self._operations_buffer = NamedTemporaryFile('w+')
-            logger.debug('Created temporary buffer file %s', self._operations_buffer.name)
+            self._operations_buffer = buffers.OperationsBuffer(self.codec, self.spill_threshold)
         return self._operations_buffer
 
     @property
@@ -106,34 +371,115 @@ class AdWords:
     @property
     def open_files(self):
         if not getattr(self.local, 'open_files', None):
-            self.local.open_files = {}
+            self.local.open_files = OrderedDict()
         return self.local.open_files
 
+    @property
+    def pending_writes(self):
+        if not getattr(self.local, 'pending_writes', None):
+            self.local.pending_writes = OrderedDict()
+            self.local.pending_count = 0
+        return self.local.pending_writes
+
+    @property
+    def evicted_files(self):
+        """
+        Files closed while still being written, reopening them must append to them instead of truncating them
+
+        It holds a name per file closed before `flush_files`, which can not be forgotten earlier: any of those
+        files may get more entries. That is at most a name per file written, no file handles are kept.
+        """
+        if not getattr(self.local, 'evicted_files', None):
+            self.local.evicted_files = set()
+        return self.local.evicted_files
+
+    @property
+    def id_mapping(self):
+        """
+        Store of the real ids of the entities created with temporary ids, see storages.IdMappingStore
+
+        It is kept in `id_mapping.sqlite3` in the storage workdir unless `id_mapping_path` is given, which is
+        required for storages that are not on the local filesystem.
+        """
+        if not self._id_mapping:
+            database = self.id_mapping_path
+            if not database:
+                if not hasattr(self.storage, 'workdir'):
+                    raise ValueError('An id_mapping_path is required for storages without a workdir')
+                database = path.join(self.storage.workdir, 'id_mapping.sqlite3')
+            self._id_mapping = storages.IdMappingStore(database)
+        return self._id_mapping
+
     def service(self, service_name):
         if service_name not in self.services:
-            self.services[service_name] = getattr(adwords_api, service_name)(self.client)
+            service = getattr(adwords_api, service_name)(self.client)
+            service.retry_policy = self.retry_policy
+            self.services[service_name] = service
         return self.services[service_name]
 
     def get_file(self, name, *args, **kwargs):
-        if name not in self.open_files:
-            self.open_files[name] = self.storage.open(name, *args, **kwargs)
+        if name in self.open_files:
+            self.open_files.move_to_end(name)
+            return self.open_files[name]
+        # least recently used handles are closed to keep the number of open files bounded
+        while len(self.open_files) >= self.max_open_files:
+            self._close_file(next(iter(self.open_files)))
+        mode = kwargs.get('mode', 'r')
+        if 'w' in mode and name in self.evicted_files:
+            # the file was closed before, reopening it must not truncate what is there
+            kwargs['mode'] = mode.replace('w', 'a')
+        self.open_files[name] = self.storage.open(name, *args, **kwargs)
         return self.open_files[name]
 
+    def _close_file(self, name):
+        file = self.open_files.pop(name)
+        if any(flag in getattr(file, 'mode', 'w') for flag in 'wa'):
+            self.evicted_files.add(name)
+        file.close()
+
+    def _write_pending(self, file_name=None):
+        names = [file_name] if file_name else list(self.pending_writes)
+        for name in names:
+            codec, records = self.pending_writes.pop(name, (None, None))
+            if records:
+                self.local.pending_count -= len(records)
+                self.get_file(name, mode=codec.write_mode).write(codec.empty.join(records))
+
     def flush_files(self):
+        self._write_pending()
         while self.open_files:
             _, file = self.open_files.popitem()
             file.flush()
             file.close()
+        self.evicted_files.clear()
+
+    def _write_entry(self, file_name, entry, codec=buffers.JSON_CODEC):
+        # entries are buffered per file and written in bulk, so that a file is reopened at most once per flush
+        self.pending_writes.setdefault(file_name, (codec, []))[1].append(codec.encode(entry))
+        self.local.pending_count += 1
+        if self.local.pending_count >= self.max_pending_writes:
+            self._write_pending()
 
-    def _write_entry(self, file_name, entry):
-        self.get_file(file_name, mode='w+').write(json.dumps(entry) + '\n')
+    def _read_entries(self, file_name, codec=buffers.JSON_CODEC):
+        self._write_pending(file_name)
+        if file_name in self.open_files:
+            self._close_file(file_name)
+        with self.storage.open(file_name, mode=codec.read_mode) as file:
+            yield from codec.iter_decode(file)
 
-    def _read_entries(self, file_name):
-        file = self.get_file(file_name, mode='r')
-        file.flush()
-        file.seek(0)
-        for line in file:
-            yield json.loads(line)
+    def _read_operations(self, file_name):
+        """
+        Entries of an operations file written by `split`.
+
+        Files written with JSON records (the format of .data files before MarshalCodec became the default codec)
+        are detected and read as such, whatever `codec` is.
+        """
+        self._write_pending(file_name)
+        if file_name in self.open_files:
+            self._close_file(file_name)
+        with self.storage.open(file_name, mode='rb') as file:
+            codec = buffers.detect_codec(file.readline(MAX_RECORD_SNIFF), self.codec)
+        yield from self._read_entries(file_name, codec)
 
     def _read_from_folder(self, folder_name, name_filter=None):
         _, files = self.storage.listdir(folder_name)
@@ -142,33 +488,154 @@ class AdWords:
                 yield from self._read_entries(path.join(folder_name, file))
 
     def _write_buffer(self, entry):
-        self.operations.write(json.dumps(entry) + '\n')
+        self.operations.write(entry)
 
     def _read_buffer(self):
-        self.operations.flush()
-        self.operations.seek(0)
-        for line in self.operations:
-            yield json.loads(line)
+        yield from self.operations
+
+    def _spill_run(self, run):
+        run_buffer = buffers.OperationsBuffer(self.codec, spill_threshold=0)
+        for (_, _, position), entry in run:
+            run_buffer.write([position, entry])
+        return run_buffer
+
+    def _read_run(self, run_buffer):
+        for position, entry in run_buffer:
+            yield _get_sort_key(entry, position), entry
+
+    def sort_operations(self, max_entries_in_memory=100000):
+        """
+        Sort the operations buffer by client_id and then parents before children (see OBJECT_TYPE_LEVELS).
+
+        This is an external merge sort: sorted runs of at most `max_entries_in_memory` entries are spilled to
+        temporary files and merged back into a new buffer. Entries with the same key keep their insertion order.
+        """
+        run_buffers = []
+        run = []
+        for position, entry in enumerate(self._read_buffer()):
+            run.append((_get_sort_key(entry, position), entry))
+            if len(run) >= max_entries_in_memory:
+                run.sort(key=itemgetter(0))
+                run_buffers.append(self._spill_run(run))
+                run = []
+        run.sort(key=itemgetter(0))
+        logger.debug('Merging %d sorted runs of operations', len(run_buffers) + 1)
+        merged = heapq.merge(iter(run), *[self._read_run(run_buffer) for run_buffer in run_buffers], key=itemgetter(0))
+        self._operations_buffer = None
+        for _, entry in merged:
+            self._write_buffer(entry)
+        for run_buffer in run_buffers:
+            run_buffer.close()
 
     def _get_min_id(self, entry):
         self.min_id = min(self.min_id, _get_dict_min_value(entry))
         return entry
 
-    def insert(self, data):
+    def _map_temporary_ids(self, entries, operations_folder, batch_size=10000):
+        """
+        Replace the temporary ids of other entities in `entries` that have a real id in the `id_mapping` of
+        `operations_folder`, one query per batch of entries
+        """
+        entries = iter(entries)
+        batch = list(islice(entries, batch_size))
+        while batch:
+            wanted = {}
+            for entry in batch:
+                for field in _parent_id_fields(entry):
+                    if _is_temporary_id(entry.get(field)) and 'client_id' in entry:
+                        wanted.setdefault((int(entry['client_id']), field), set()).add(entry[field])
+            real_ids = {key: self.id_mapping.get_many(operations_folder, key[0], key[1], temp_ids)
+                        for key, temp_ids in wanted.items()}
+            for entry in batch:
+                mapped_entry = entry
+                for field in _parent_id_fields(entry):
+                    value = entry.get(field)
+                    if _is_temporary_id(value) and 'client_id' in entry:
+                        real_id = real_ids[int(entry['client_id']), field].get(value)
+                        if real_id is not None:
+                            if mapped_entry is entry:
+                                mapped_entry = entry.copy()
+                            mapped_entry[field] = real_id
+                yield mapped_entry
+            batch = list(islice(entries, batch_size))
+
+    def insert(self, data, map_ids=False, operations_folder=''):
+        """
+        Add operation entries (a dict or an iterable of dicts) to the operations buffer.
+
+        With `map_ids`, temporary ids of entities created by the batch jobs of `operations_folder` (as recorded by
+        `download_results`) are replaced by their real ids, so later stages can refer to them. Only references to
+        other entities are replaced: the id of the entity an ADD entry creates is kept.
+        """
         if isinstance(data, Mapping):
-            data = [self._get_min_id(data)]
-        else:
-            data = (self._get_min_id(entry) for entry in data)
-        for entry in data:
+            data = [data]
+        if map_ids:
+            data = self._map_temporary_ids(data, operations_folder)
+        for entry in map(self._get_min_id, data):
             if 'client_id' not in entry:
                 raise ValueError('Every entry must have a "client_id" field.')
             self._write_buffer(entry)
 
+    def insert_columns(self, object_type, client_id=None, chunk_size=10000, **columns):
+        """
+        Insert one entry per row of the parallel `columns` (lists, array.array or numpy arrays).
+
+        Scalar values are repeated on every row, so a bid sheet can be loaded with something like
+        `insert_columns('keyword', client_id=7857288943, operator='SET', adgroup_id=adgroup_ids,
+        criteria_id=criteria_ids, cpc_bid=bids)`. Only the `*_id` columns are scanned for temporary ids.
+        """
+        if client_id is None:
+            raise ValueError('Every entry must have a "client_id" field.')
+        columns['client_id'] = client_id
+        columns['object_type'] = object_type
+        names = []
+        values = []
+        constants = {}
+        length = None
+        for name, column in columns.items():
+            if isinstance(column, (str, bytes)) or not hasattr(column, '__len__'):
+                constants[name] = column
+                column = [column]
+            else:
+                if length is None:
+                    length = len(column)
+                elif len(column) != length:
+                    raise ValueError('Column "{}" has {} rows instead of {}.'.format(name, len(column), length))
+                names.append(name)
+                # numpy and array.array columns are converted to python values in a single pass
+                values.append(column.tolist() if hasattr(column, 'tolist') else column)
+            if name.endswith('_id'):
+                self.min_id = min(self.min_id, _get_column_min_value(column))
+        if length is None:
+            self.insert(constants)
+            return
+        rows = zip(*values)
+        for start in range(0, length, chunk_size):
+            entries = []
+            for row in islice(rows, chunk_size):
+                entry = dict(zip(names, row))
+                entry.update(constants)
+                entries.append(entry)
+            self.operations.write_many(entries)
+
     def get_report(self, report_type, customer_id, exclude_fields=[],
                    exclude_terms=['Significance'], exclude_behavior=['Segment'],
                    include_fields=[], *args, **kwargs):
+        """
+        Download a report as a list of rows.
+
+        With `stream=True` a generator of rows is returned instead, parsing the report while it is downloaded
+        so memory use does not grow with the report size. Closing the generator closes the download.
+        `row_factory` is the type of the rows, as in `utils.csv_reader`. With `columnar=True` the report is
+        returned as a `utils.ReportColumns`, numbers being stored in typed arrays.
+        """
         logger.info('Getting %s...', report_type)
         simple_download = kwargs.pop('simple_download', False)
+        stream = kwargs.pop('stream', False)
+        row_factory = kwargs.pop('row_factory', 'dict')
+        columnar = kwargs.pop('columnar', False)
+        if columnar:
+            row_factory = 'tuple'
         only_fields = kwargs.pop('fields', None)
         report_csv = common.get_report_csv(report_type)
         report_csv = dict((item['Name'], item) for item in csv.DictReader(StringIO(report_csv)))
@@ -190,21 +657,34 @@ class AdWords:
         if simple_download:
             return report_stream
         else:
-            raw_report = utils.gunzip(report_stream)
             converter = {
                 field: MAPPERS.get(report_csv[field]['Type']).from_adwords_func
                 for field in fields if report_csv[field]['Type'] in MAPPERS
             }
-            report_iterator = utils.csv_reader(raw_report, fields, converter=converter)
-            report = list(report_iterator())
-            return report
+            raw_report = utils.gunzip(report_stream)
+            try:
+                rows = utils.csv_reader(raw_report, fields, converter=converter, row_factory=row_factory)
+            except ValueError:
+                raw_report.close()
+                raise
+            report = _ReportRows(raw_report, rows)
+            if columnar:
+                columns = utils.ReportColumns(fields, {field: report_csv[field]['Type'] for field in fields})
+                columns.extend(report)
+                return columns
+            if stream:
+                return report
+            return list(report)
 
     def log_batchjob(self, batchjob_service, file_name, comment=''):
         logger.info('Running %s...', inspect.stack()[0][3])
+        self._write_entry(file_name, self._get_batchjob_entry(batchjob_service, comment))
+
+    def _get_batchjob_entry(self, batchjob_service, comment=''):
         client_id = batchjob_service.client.client_customer_id
-        batchjob_id = batchjob_service.batch_job.result['value'][0].id
-        batchjob_upload_url = batchjob_service.batch_job.result['value'][0].uploadUrl.url
-        batchjob_status = batchjob_service.batch_job.result['value'][0].status
+        batchjob_id = batchjob_service.job['id']
+        batchjob_upload_url = batchjob_service.job['upload_url']
+        batchjob_status = batchjob_service.job['status']
         data = {'creation_time': datetime.datetime.now().isoformat(),
                 'client_id': client_id,
                 'batchjob_id': batchjob_id,
@@ -212,106 +692,462 @@ class AdWords:
                 'result_url': '',
                 'metadata': comment,
                 'status': batchjob_status}
-        self._write_entry(file_name, data)
+        return data
 
-    def _update_jobs_status(self, jobs):
+    def _update_jobs_status(self, jobs, operations_folder=None):
+        """
+        Apply the statuses in jobs['dirty'] to the pending and done jobs.
+
+        If `operations_folder` is given, every job whose status or progress changed is appended to its
+        `jobs.journal` right away. Returns the number of changed jobs.
+        """
         logger.info('Running %s...', inspect.stack()[0][3])
+        changed_jobs = []
         while jobs['dirty']:
             client_id, job_list = jobs['dirty'].popitem()
             for dirty_job in job_list:
                 pending_job = jobs['pending'][client_id][dirty_job['id']]
-                if dirty_job['status'] != pending_job['status']:
-                    formatted_dirty_job = {
-                        'status': dirty_job['status'],
-                        'result_url': dirty_job['downloadUrl']['url'] if dirty_job['downloadUrl'] else '',
-                        'client_id': client_id,
-                        'batchjob_id': dirty_job['id'],
+                formatted_dirty_job = {
+                    'status': dirty_job['status'],
+                    'result_url': dirty_job['downloadUrl']['url'] if dirty_job['downloadUrl'] else '',
+                    'client_id': client_id,
+                    'batchjob_id': dirty_job['id'],
+                }
+                progress = {}
+                if 'progressStats' in dirty_job:
+                    progress = {
+                        'estimated_percent_executed': dirty_job['progressStats']['estimatedPercentExecuted'],
+                        'num_operations_executed': dirty_job['progressStats']['numOperationsExecuted'],
+                        'num_operations_succeeded': dirty_job['progressStats']['numOperationsSucceeded'],
+                        'num_results_written': dirty_job['progressStats']['numResultsWritten'],
                     }
-                    progress = {}
-                    if 'progressStats' in dirty_job:
-                        progress = {
-                            'estimated_percent_executed': dirty_job['progressStats']['estimatedPercentExecuted'],
-                            'num_operations_executed': dirty_job['progressStats']['numOperationsExecuted'],
-                            'num_operations_succeeded': dirty_job['progressStats']['numOperationsSucceeded'],
-                            'num_results_written': dirty_job['progressStats']['numResultsWritten'],
-                        }
-                    formatted_dirty_job.update(progress)
-
-                    # remove job from pending dict if it is done or cancelled and add it to done dict
-                    if dirty_job['status'] == 'DONE' or dirty_job['status'] == 'CANCELED':
-                        del jobs['pending'][client_id][dirty_job['id']]
-                        if not jobs['pending'][client_id]:
-                            del jobs['pending'][client_id]
-                        jobs['done'].setdefault(client_id, {})[dirty_job['id']] = formatted_dirty_job
+                formatted_dirty_job.update(progress)
+                if any(pending_job.get(key) != value for key, value in formatted_dirty_job.items()):
+                    changed_jobs.append(formatted_dirty_job)
+
+                # remove job from pending dict if it is done or cancelled and add it to done dict
+                if dirty_job['status'] == 'DONE' or dirty_job['status'] == 'CANCELED':
+                    del jobs['pending'][client_id][dirty_job['id']]
+                    if not jobs['pending'][client_id]:
+                        del jobs['pending'][client_id]
+                    jobs['done'].setdefault(client_id, {})[dirty_job['id']] = formatted_dirty_job
+                else:
+                    # the progress of running jobs drives the polling of wait_jobs
+                    pending_job.update(formatted_dirty_job)
+        if operations_folder is not None and changed_jobs:
+            self._append_jobs_journal(operations_folder, changed_jobs)
+        return len(changed_jobs)
+
+    def _append_entries(self, file_name, entries, mode='a'):
+        # written and closed at once, bypassing the buffered writes, so other processes (and threads) see the
+        # entries right away
+        with self.storage.open(file_name, mode=mode) as file:
+            file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+
+    def _append_jobs_journal(self, operations_folder, changed_jobs):
+        self._append_entries(path.join(operations_folder, 'jobs.journal'), changed_jobs)
+
+    def _compact_jobs_journal(self, operations_folder, jobs):
+        """
+        Write the state of every job to `jobs.status` and empty `jobs.journal`.
+
+        The snapshot is written to a temporary file that then replaces `jobs.status`, on storages that can replace
+        files, so a process stopped while writing it leaves the previous snapshot. If it stops before the journal
+        is emptied, replaying the journal over the new snapshot changes nothing, since journal records hold the
+        whole state of a job.
+        """
+        status_name = path.join(operations_folder, 'jobs.status')
+        replace = getattr(self.storage, 'replace', None)
+        with self.storage.open(status_name + '.tmp' if replace else status_name, mode='w') as file:
+            file.write(json.dumps({'pending': jobs['pending'], 'dirty': {}, 'done': jobs['done']}) + '\n')
+        if replace:
+            replace(status_name + '.tmp', status_name)
+        with self.storage.open(path.join(operations_folder, 'jobs.journal'), mode='w'):
+            pass
+
+    def _read_jobs_journal(self, operations_folder):
+        """
+        Last known state of the jobs of `operations_folder`, from `jobs.status` and the `jobs.journal` records
+        """
+        states = {}
+        for name in ('jobs.status', 'jobs.journal'):
+            try:
+                with self.storage.open(path.join(operations_folder, name), mode='r') as file:
+                    lines = file.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a record left half written by a process that stopped while appending to the journal
+                    logger.warning('Skipping a damaged record of %s', name)
+                    continue
+                if name == 'jobs.status':
+                    for group in ('pending', 'done'):
+                        for client_jobs in record[group].values():
+                            for job in client_jobs.values():
+                                states[job['batchjob_id']] = job
+                else:
+                    states.setdefault(record['batchjob_id'], {}).update(record)
+        return states
 
     def _collect_jobs(self, operations_folder):
+        known_jobs = self._read_jobs_journal(operations_folder)
         batchjobs = {}
+        done = {}
         for operation in self._read_from_folder(operations_folder, name_filter=lambda x: x.endswith('.result')):
             client_id = operation['client_id']
-            if operation['status'] != 'DONE' and operation['status'] != 'CANCELED':
-                batchjobs.setdefault(client_id, {})[operation['batchjob_id']] = operation
-        return {'pending': batchjobs, 'dirty': {}, 'done': {}}
+            job = dict(operation, **known_jobs.get(operation['batchjob_id'], {}))
+            if job['status'] != 'DONE' and job['status'] != 'CANCELED':
+                batchjobs.setdefault(client_id, {})[job['batchjob_id']] = job
+            else:
+                done.setdefault(client_id, {})[job['batchjob_id']] = job
+        return {'pending': batchjobs, 'dirty': {}, 'done': done}
+
+    def wait_jobs(self, operations_folder='', min_sleep=15, max_sleep=600, journal_compaction=1000):
+        """
+        Poll the batch jobs of `operations_folder` until all of them are done or canceled.
 
-    def wait_jobs(self, operations_folder=''):
+        Status changes are appended to `jobs.journal` as they are seen, and folded into the `jobs.status` snapshot
+        every `journal_compaction` records and at the end. Jobs already finished according to them are not polled
+        again, so a restarted waiter picks up where the previous one stopped, and other processes can follow the
+        progress of the jobs by reading both files.
+        """
         logger.info('Running %s...', inspect.stack()[0][3])
         jobs = self._collect_jobs(operations_folder)
-        sleep_time = 15
+        scheduler = JobPollScheduler(min_sleep, max_sleep)
+        journal_size = 0
         bjs = None
         while len(jobs['pending']) > 0:
             if not bjs:
                 bjs = self.service('BatchJobService')
             jobs['dirty'] = bjs.get_multiple_status(jobs['pending'])
-            self._update_jobs_status(jobs)
+            journal_size += self._update_jobs_status(jobs, operations_folder)
+            if journal_size >= journal_compaction:
+                self._compact_jobs_journal(operations_folder, jobs)
+                journal_size = 0
             # only sleep if we still have pending jobs
             if len(jobs['pending']) > 0:
-                logger.info('Waiting for batch jobs to finish...')
+                sleep_time = scheduler.next_sleep(jobs['pending'])
+                logger.info('Waiting %.0fs for batch jobs to finish...', sleep_time)
                 time.sleep(sleep_time)
-                sleep_time *= 2
-        self._write_entry(path.join(operations_folder, 'jobs.status'), jobs)
-        self.flush_files()
+        self._compact_jobs_journal(operations_folder, jobs)
         return jobs
 
+    def _write_job_index(self, operations_folder, batchjob_id, start, origins):
+        """
+        Record the origin (operation file and entry) of the operations uploaded to a job from index `start` on
+
+        Consecutive operations built from the same entry are stored as a single [file, entry, count] run.
+        """
+        runs = []
+        for origin, group in groupby(origins):
+            runs.append([origin[0], origin[1], sum(1 for _ in group)])
+        if runs:
+            self._append_entries(path.join(operations_folder, '{}.index'.format(batchjob_id)), [[start, runs]])
+
+    def _read_job_index(self, operations_folder, batchjob_id):
+        # chunks rebuilt when resuming an interrupted upload are recorded twice, with the same start
+        chunks = dict(self._read_entries(path.join(operations_folder, '{}.index'.format(batchjob_id))))
+        starts = []
+        origins = []
+        for start in sorted(chunks):
+            for file_name, entry_index, count in chunks[start]:
+                starts.append(start)
+                origins.append((file_name, entry_index))
+                start += count
+        return starts, origins
+
+    def _read_temporary_ids(self, file_name):
+        temporary_ids = []
+        for entry in self._read_operations(file_name):
+            temporary_ids.append({field: entry[field] for field in TEMPORARY_ID_FIELDS
+                                  if _is_temporary_id(entry.get(field))} or None)
+        return temporary_ids
+
+    def _reconcile_job(self, task):
+        operations_folder, job = task
+        batchjob_id = job['batchjob_id']
+        try:
+            starts, origins = self._read_job_index(operations_folder, batchjob_id)
+        except OSError:
+            # jobs uploaded before job indexes were written, or by a custom map_function
+            logger.warning('No index for batchjob %s, its results cannot be reconciled', batchjob_id)
+            return None
+        temporary_ids = {}
+        id_mappings = []
+        logger.info('Downloading results of batchjob %s', batchjob_id)
+        response = requests.get(job['result_url'], stream=True)
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            number_of_results = 0
+            for result in iter_results(response.raw):
+                file_name, entry_index = origins[bisect_right(starts, result['index']) - 1]
+                field = RESULT_ID_FIELDS.get(result['type'])
+                if field and result['id'] is not None:
+                    if file_name not in temporary_ids:
+                        temporary_ids[file_name] = self._read_temporary_ids(file_name)
+                    entry_ids = temporary_ids[file_name][entry_index]
+                    if entry_ids and field in entry_ids:
+                        id_mappings.append((operations_folder, int(job['client_id']), field, entry_ids[field],
+                                            result['id']))
+                self._write_entry('{}.{}.outcome'.format(file_name, batchjob_id), {
+                    'batchjob_id': batchjob_id,
+                    'entry': entry_index,
+                    'index': result['index'],
+                    'success': not result['errors'],
+                    'type': result['type'],
+                    'id': result['id'],
+                    'errors': result['errors'],
+                })
+                number_of_results += 1
+        finally:
+            response.close()
+            self.flush_files()
+        self.id_mapping.add(id_mappings)
+        logger.info('Reconciled %d results of batchjob %s', number_of_results, batchjob_id)
+        return number_of_results
+
+    def download_results(self, operations_folder='', jobs=None):
+        """
+        Download the results of the batch jobs of `operations_folder` and match them with the operation files.
+
+        Results are parsed while they are downloaded, several jobs at a time (see thread_map). The outcome of
+        every operation is written to `<operations file>.<batchjob_id>.outcome`, along with the index of the
+        entry of the operations file it was built from, and the real ids of the entities created with temporary
+        ids are stored in `id_mapping`, scoped to `operations_folder`. `jobs` defaults to the result of `wait_jobs`.
+        """
+        logger.info('Running %s...', inspect.stack()[0][3])
+        jobs = jobs or self.wait_jobs(operations_folder)
+        tasks = [(operations_folder, job)
+                 for client_jobs in jobs['done'].values() for job in client_jobs.values() if job['result_url']]
+        return dict(zip((job['batchjob_id'] for _, job in tasks), self.thread_map(self._reconcile_job, tasks)))
+
     def split(self, operations_folder=''):
+        """
+        Write the entries of the buffer to one `<campaign_id>.data` file per campaign in `operations_folder`.
+
+        The client_id and number of operations of every file are stored in `operations.summary`, for `_pack_files`.
+        """
         operations_folder = operations_folder or str(uuid.uuid1())
+        summary = self._read_summary(operations_folder)
+        operation_builder = OperationsBuilder()
+        written = set()
         for entry in self._read_buffer():
-            self._write_entry(path.join(operations_folder, '{}.data'.format(entry['campaign_id'])), entry)
+            file_name = '{}.data'.format(entry['campaign_id'])
+            self._write_entry(path.join(operations_folder, file_name), entry, self.codec)
+            if file_name not in written:
+                # files written by a previous split are truncated, and so is their count
+                summary[file_name] = [entry['client_id'], 0]
+                written.add(file_name)
+            summary[file_name][1] += operation_builder.count_operations(entry)
+        self._write_pending()
+        self._write_checkpoint(path.join(operations_folder, 'operations.summary'), summary)
 
         def _close_file(file_handler):
             file_handler.flush()
             file_handler.close()
 
+        # at most max_open_files handles are still open at this point
         with ThreadPoolExecutor() as executor:
-            executor.map(_close_file, self.open_files.values())
+            list(executor.map(_close_file, self.open_files.values()))
 
         self.open_files.clear()
+        self.evicted_files.clear()
         return operations_folder
 
-    def _batch_operations(self, file_name):
-        logger.info('Processing operation file %s', file_name)
+    def _read_checkpoint(self, checkpoint_name):
+        try:
+            with self.storage.open(checkpoint_name, mode='r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_checkpoint(self, checkpoint_name, checkpoint):
+        with self.storage.open(checkpoint_name, mode='w') as file:
+            json.dump(checkpoint, file)
+
+    def _batch_operations(self, file_names):
+        """
+        Upload the operations of `file_names` into batch jobs, starting a new job whenever client_id changes.
+
+        Building the operations, serializing each chunk and uploading it run as a pipeline in three threads, so
+        the next chunk is built and serialized while the previous one is uploaded. The number of operations per
+        chunk is adapted to the serialized size of the operations and to the upload latency (see ChunkSizer).
+        Jobs are created by the upload stage, once the last chunk of the previous job is uploaded.
+
+        A checkpoint with the position of the next operation to upload, the current job, the state of its
+        incremental upload and the `min_id` temporary ids start from is written to `<first file>.checkpoint` when a
+        job is created, before sending every chunk (with the end of the chunk) and after it. Jobs are logged in the
+        `.result` files of the operation files only after a checkpoint refers to them. If the process dies, running
+        this again over the same files builds the already uploaded operations again (to get to the same temporary
+        ids) but only uploads the remaining ones, continuing the interrupted job. A chunk that was being sent is
+        rebuilt with the same operations, and only the bytes the server did not store are sent again.
+
+        The file and entry every uploaded operation was built from are recorded in `<batchjob_id>.index`, so that
+        `download_results` can match the results of the job with the operation files.
+        """
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        checkpoint_name = file_names[0] + '.checkpoint'
+        checkpoint = self._read_checkpoint(checkpoint_name)
+        if checkpoint and checkpoint['complete']:
+            logger.info('Operation files %s were already uploaded', ', '.join(file_names))
+            return
+        logger.info('Processing operation files %s', ', '.join(file_names))
+        operations_folder = path.dirname(file_names[0])
         bjs = self.service('BatchJobService')
-        operation_builder = OperationsBuilder(self.min_id)
-        previous_client_id = None
-        batch_size = 5000
-        run_final_upload = False
-        for internal_operation in self._read_entries(file_name):
-            run_final_upload = True
-            client_id = internal_operation['client_id']
-            if client_id != previous_client_id:
-                if previous_client_id is not None:
-                    bjs.helper.upload_operations(is_last=True)
-                previous_client_id = client_id
-                bjs.prepare_job(int(client_id))
-                self.log_batchjob(bjs, file_name + '.result')
-                in_batch = 0
-            for operation in operation_builder(internal_operation):
-                if operation:
-                    if in_batch > 0 and in_batch % batch_size == 0:
-                        bjs.helper.upload_operations()
-                    bjs.helper.add_operation(operation)
-                    in_batch += 1
-        if run_final_upload:
-            bjs.helper.upload_operations(is_last=True)
-        self.flush_files()
+        serializer = bjs.operations_serializer
+        chunk_sizer = ChunkSizer(callback=self.chunk_size_hook)
+        checkpoint = checkpoint or {'files': file_names, 'result_files': [], 'position': None, 'complete': False}
+        # temporary ids are generated from min_id, a rerun must build the operations from the same starting point
+        for key, value in (('client_id', None), ('job', None), ('upload_helper', None), ('job_files', []),
+                           ('job_operations', 0), ('min_id', self.min_id), ('pending_end', None)):
+            checkpoint.setdefault(key, value)
+        resume_position = (0, 0, 0)
+        # end of the chunk that was being sent when the upload was interrupted, the server may have stored it
+        pending_end = None
+        # client_id of the job the next chunk is uploaded to, if that job already exists
+        job_client_id = None
+        if checkpoint['position']:
+            resume_position = tuple(checkpoint['position'])
+            if checkpoint['pending_end']:
+                pending_end = tuple(checkpoint['pending_end'])
+            if checkpoint['upload_helper']:
+                job_client_id = checkpoint['client_id']
+                bjs.resume_job(checkpoint['job'], checkpoint['upload_helper'], int(job_client_id))
+                # the interrupted run may have stopped between writing the checkpoint and logging the job, logging
+                # it again only adds duplicate entries, which are merged when the result files are read
+                for file_name in checkpoint['job_files']:
+                    self._append_entries(file_name + '.result', [self._get_batchjob_entry(bjs)])
+            logger.info('Resuming upload at file %d, entry %d, operation %d', *resume_position)
+
+        def _new_chunk(client_id, position):
+            return {'client_id': client_id, 'start': position, 'end': None, 'operations': OrderedDict(),
+                    'origins': OrderedDict(), 'files': [], 'size': 0, 'is_last': False, 'complete': False,
+                    'new_job': client_id != job_client_id, 'check_committed': False}
+
+        def _build_chunks():
+            nonlocal job_client_id
+            operation_builder = OperationsBuilder(checkpoint['min_id'])
+            chunk = None
+            chunk_size = chunk_sizer.next_size()
+            # the interrupted chunk is rebuilt with the same operations, so its bytes match what the server stored
+            chunk_end = pending_end
+            for file_index, file_name in enumerate(checkpoint['files']):
+                for entry_index, internal_operation in enumerate(self._read_operations(file_name)):
+                    # operations are always built, so that the builder state is the same as in an interrupted run
+                    for operation_index, operation in enumerate(operation_builder(internal_operation)):
+                        position = (file_index, entry_index, operation_index)
+                        if not operation or position < resume_position:
+                            continue
+                        client_id = internal_operation['client_id']
+                        is_full = position == chunk_end if chunk_end else chunk and chunk['size'] >= chunk_size
+                        if chunk and (client_id != chunk['client_id'] or is_full):
+                            chunk['end'] = position
+                            chunk['is_last'] = client_id != chunk['client_id']
+                            yield chunk
+                            chunk = None
+                            chunk_end = None
+                            chunk_size = chunk_sizer.next_size()
+                        if not chunk:
+                            chunk = _new_chunk(client_id, position)
+                            chunk['check_committed'] = bool(chunk_end)
+                            job_client_id = client_id
+                        xsi_type = operation['xsi_type']
+                        chunk['operations'].setdefault(xsi_type, []).append(operation)
+                        chunk['origins'].setdefault(xsi_type, []).append((file_name, entry_index))
+                        if not chunk['files'] or chunk['files'][-1] != file_name:
+                            chunk['files'].append(file_name)
+                        chunk['size'] += 1
+            if chunk:
+                chunk.update(end=(len(checkpoint['files']), 0, 0), is_last=True, complete=True)
+                yield chunk
+
+        def _serialize(chunk):
+            chunk['operations'] = list(chunk['operations'].values())
+            # encoded here so the upload stage only pads it, its length is the payload size given to chunk_sizer
+            chunk['xml'] = serializer.serialize(chunk['operations']).encode('utf-8')
+            return chunk
+
+        def _upload(chunk):
+            if chunk['new_job']:
+                bjs.prepare_job(int(chunk['client_id']))
+                checkpoint.update(position=chunk['start'], client_id=chunk['client_id'], job=bjs.job, job_files=[],
+                                  job_operations=0, upload_helper=bjs.helper.dump_upload_helper())
+            new_files = [file_name for file_name in chunk['files'] if file_name not in checkpoint['job_files']]
+            if new_files:
+                # result files are truncated the first time this upload logs a job in them
+                truncated_files = [file_name for file_name in new_files if file_name not in checkpoint['result_files']]
+                checkpoint['result_files'].extend(truncated_files)
+                checkpoint['job_files'] = sorted(checkpoint['job_files'] + new_files)
+                # every file that contributes to a job gets the job logged in its result file, after the checkpoint
+                # refers to the job so that a rerun continues it instead of leaving it logged without operations
+                self._write_checkpoint(checkpoint_name, checkpoint)
+                for file_name in new_files:
+                    self._append_entries(file_name + '.result', [self._get_batchjob_entry(bjs)],
+                                         mode='w' if file_name in truncated_files else 'a')
+            origins = list(chain.from_iterable(chunk['origins'].values()))
+            self._write_job_index(operations_folder, bjs.job['id'], checkpoint['job_operations'], origins)
+            request = bjs.helper.build_request(chunk['xml'], chunk['is_last'])
+            checkpoint['pending_end'] = chunk['end']
+            self._write_checkpoint(checkpoint_name, checkpoint)
+            start = timeit.default_timer()
+            bjs.helper.send(request, chunk['is_last'], check_committed=chunk['check_committed'])
+            chunk_sizer.record_upload(chunk['size'], len(chunk['xml']), timeit.default_timer() - start)
+            checkpoint.update(position=chunk['end'], complete=chunk['complete'], pending_end=None,
+                              job_operations=checkpoint['job_operations'] + chunk['size'],
+                              upload_helper=None if chunk['is_last'] else bjs.helper.dump_upload_helper())
+            self._write_checkpoint(checkpoint_name, checkpoint)
+
+        utils.pipeline(_build_chunks(), _serialize, _upload)
+
+    def _read_summary(self, operations_folder):
+        return self._read_checkpoint(path.join(operations_folder, 'operations.summary')) or {}
+
+    def _summarize_file(self, file_name):
+        client_id = None
+        number_of_operations = 0
+        operation_builder = OperationsBuilder()
+        for internal_operation in self._read_operations(file_name):
+            if client_id is None:
+                client_id = internal_operation['client_id']
+            number_of_operations += operation_builder.count_operations(internal_operation)
+        return client_id, number_of_operations
+
+    def _pack_files(self, file_names, pack_size):
+        """
+        Group operation files of the same client_id so that each group holds at most `pack_size` batch job operations.
+
+        Operations are counted as built from the entries (a campaign entry becomes its budget, campaign and criteria
+        operations). The counts come from the `operations.summary` written by `split`, files missing from it are
+        read to count them. Files are never split between groups, so every campaign still goes entirely into a
+        single batch job and its temporary ids keep resolving. A file larger than `pack_size` gets a group of its own.
+        """
+        packs = []
+        open_packs = {}
+        summaries = {}
+        for file_name in sorted(file_names):
+            folder, name = path.split(file_name)
+            if folder not in summaries:
+                summaries[folder] = self._read_summary(folder)
+            if name in summaries[folder]:
+                client_id, number_of_operations = summaries[folder][name]
+            else:
+                client_id, number_of_operations = self._summarize_file(file_name)
+            if not number_of_operations:
+                continue
+            pack = open_packs.get(client_id)
+            if pack is None or pack['size'] + number_of_operations > pack_size:
+                pack = {'files': [], 'size': 0}
+                open_packs[client_id] = pack
+                packs.append(pack['files'])
+            pack['files'].append(file_name)
+            pack['size'] += number_of_operations
+        logger.info('Packed %d operation files into %d batch jobs', len(file_names), len(packs))
+        return packs
 
     def _get_service_from_object_type(self, internal_operation):
         object_type_service_mapper = {
@@ -352,55 +1188,141 @@ class AdWords:
         try:
             return object_type_service_mapper.get(internal_operation['object_type'])
         except KeyError:
-            logger.debug('There is no custom service class for this object_type: %s', str(internal_operation['object_type']))
+            logger.debug('There is no custom service class for this object_type: %s',
+                         str(internal_operation['object_type']))
             raise
 
-    def _sync_operations(self):
-        operation_builder = OperationsBuilder()
-        results = []
+    def _mutate_sync_batch(self, service, client_id, batch, results):
+        """
+        Mutate `batch` with `service`, storing the results by position. Returns the errors of every failed position
+        """
+        service.prepare_mutate(sync=True)
+        for _, adwords_operation in batch:
+            service.helper.add_operation(adwords_operation)
+        partial_results = service.mutate(client_customer_id=client_id, sync=True)
+        positions = {id(adwords_operation): position for position, adwords_operation in batch}
+        operations_sent = getattr(partial_results, 'operations_sent', [operation for _, operation in batch])
+        for operation, result in zip(operations_sent, partial_results):
+            results[positions[id(operation)]] = result
+        failures = OrderedDict()
+        get_errors = getattr(partial_results, "get_errors", None)
+        for error in get_errors() if callable(get_errors) else []:
+            failures.setdefault(positions[id(error['operation_failed'])], []).append(error)
+        return failures
+
+    def _sync_group(self, task):
+        """
+        Mutate the operations of one (client_id, service_name) group, in order and `max_operations` at a time.
+
+        Operations that fail only with retryable errors (see RetryPolicy.is_retryable) are sent again on their own,
+        after the delay and up to the attempts allowed by the retry policy. Returns the results and errors by
+        position, and the operations that failed for good (with errors that retrying does not fix, or after the last
+        attempt).
+        """
+        (client_id, service_name), operations, max_operations = task
+        service = self.service(service_name)
+        retry_policy = self.retry_policy or common.RetryPolicy()
+        results = {}
         errors = []
-        number_of_operations = 0
-        max_operations = 1000
-        service = None
-        client_id = None
+        dead_letters = []
+        start = 0
+        while start < len(operations):
+            # the sync helper takes a single operation type per mutate
+            xsi_type = operations[start][1].get('xsi_type')
+            end = start + 1
+            while end < len(operations) and end - start < max_operations \
+                    and operations[end][1].get('xsi_type') == xsi_type:
+                end += 1
+            batch = operations[start:end]
+            start = end
+            attempt = 0
+            while batch:
+                attempt += 1
+                failures = self._mutate_sync_batch(service, client_id, batch, results)
+                operations_by_position = dict(batch)
+                batch = []
+                resend_errors = []
+                for position, operation_errors in failures.items():
+                    retryable = all(retry_policy.is_retryable(error) for error in operation_errors)
+                    if retryable and attempt < retry_policy.max_attempts:
+                        batch.append((position, operations_by_position[position]))
+                        resend_errors.extend(operation_errors)
+                        continue
+                    errors.extend((position, error) for error in operation_errors)
+                    dead_letters.append((position, {
+                        'client_id': client_id,
+                        'service_name': service_name,
+                        'operation': operations_by_position[position],
+                        'errors': [common.describe_api_error(error) for error in operation_errors],
+                    }))
+                if batch:
+                    # rate exceeded errors are resent after the retryAfterSeconds of the server, like failed calls
+                    delay = retry_policy.get_resend_delay(resend_errors, attempt)
+                    logger.info('Resending %d failed operations of %s in %.1fs', len(batch), service_name, delay)
+                    time.sleep(delay)
+        return sorted(results.items()), errors, dead_letters
+
+    def _sync_operations(self, max_workers=None, max_operations=1000, dead_letter_file='sync_failures.deadletter'):
+        """
+        Mutate the operations of the buffer with the synchronous services.
+
+        Operations are grouped by client_id and service, and the groups are mutated concurrently by up to
+        `max_workers` threads of `thread_pool` (`max_threads`, or MAX_SYNC_WORKERS, by default). A single group is
+        mutated in the calling thread. Within a group operations keep their order. Results and
+        errors are returned in the order of the operations they belong to. Operations that failed for good, with
+        errors that retrying does not fix or after the last attempt of the retry policy, are appended with their
+        errors to `dead_letter_file` in the storage.
+        """
+        operation_builder = OperationsBuilder()
+        groups = OrderedDict()
+        position = 0
         for internal_operation in self._read_buffer():
-            client_id = internal_operation['client_id']
-            service_name = self._get_service_from_object_type(internal_operation)
-            service = self.service(service_name)
-            if not number_of_operations:
-                service.prepare_mutate(sync=True)
+            key = (internal_operation['client_id'], self._get_service_from_object_type(internal_operation))
             for adwords_operation in operation_builder(internal_operation, sync=True):
                 if adwords_operation:
-                    number_of_operations += 1
-                    service.helper.add_operation(adwords_operation)
-                    if number_of_operations > 0 and number_of_operations % max_operations == 0:
-                        partial_results = service.mutate(client_customer_id=client_id, sync=True)
-                        get_errors = getattr(partial_results, "get_errors", None)
-                        partial_errors = get_errors() if callable(get_errors) else []
-                        results.extend(partial_results)
-                        errors.extend(partial_errors)
-                        service.prepare_mutate(sync=True)
-        if service:
-            if service.helper.operations:
-                partial_results = service.mutate(client_customer_id=client_id, sync=True)
-                get_errors = getattr(partial_results, "get_errors", None)
-                partial_errors = get_errors() if callable(get_errors) else []
-                results.extend(partial_results)
-                errors.extend(partial_errors)
+                    groups.setdefault(key, []).append((position, adwords_operation))
+                    position += 1
+        results = []
+        errors = []
+        dead_letters = []
+        tasks = [(key, operations, max_operations) for key, operations in groups.items()]
+        workers = min(max_workers or self.max_threads or MAX_SYNC_WORKERS, len(tasks))
+        if workers > 1:
+            # the thread local must exist before the threads race to create it
+            self._local = self._local or local()
+            # each thread mutates every `workers`-th group, so no more than `workers` threads of the pool are busy
+            lanes = self.thread_pool.map(lambda lane: list(map(self._sync_group, lane)),
+                                         [tasks[i::workers] for i in range(workers)])
+            group_outputs = chain.from_iterable(lanes)
+        else:
+            group_outputs = map(self._sync_group, tasks)
+        for group_results, group_errors, group_dead_letters in group_outputs:
+            results.extend(group_results)
+            errors.extend(group_errors)
+            dead_letters.extend(group_dead_letters)
         self._operations_buffer = None
-        return results, errors
+        if dead_letters:
+            dead_letters.sort(key=itemgetter(0))
+            logger.warning('%d operations failed permanently, see %s', len(dead_letters), dead_letter_file)
+            with self.storage.open(dead_letter_file, mode='a') as file:
+                file.write(''.join(json.dumps(dead_letter) + '\n' for _, dead_letter in dead_letters))
+        results.sort(key=itemgetter(0))
+        errors.sort(key=itemgetter(0))
+        return [result for _, result in results], [error for _, error in errors]
 
     # TODO: this method should instantiate a new class (maybe SyncOperation) and transform the internal functions
     # into instance methods. Also, separate the treatment for each "object_type" into a new method as well.
-    def execute_operations(self, operations_folder=None, sync=False, force_all=False):
+    def execute_operations(self, operations_folder=None, sync=False, force_all=False, pack_size=None,
+                           max_workers=None, dead_letter_file='sync_failures.deadletter'):
         if sync:
-            return self._sync_operations()
+            return self._sync_operations(max_workers, dead_letter_file=dead_letter_file)
         else:
             if not operations_folder:
                 raise ValueError('Async operations must have an operation folder defined.')
             logger.info('Running %s...', inspect.stack()[0][3])
             _, folder_files = self.storage.listdir(operations_folder)
             files = {}
+            resumed_files = []
             for file_path in folder_files:
                 data_file = None
                 result_file = None
@@ -409,14 +1331,39 @@ class AdWords:
                 elif file_path.endswith('.result'):
                     data_file, _, _ = file_path.rpartition('.')
                     result_file = file_path
+                elif file_path.endswith('.checkpoint'):
+                    checkpoint_name = path.join(operations_folder, file_path)
+                    checkpoint = self._read_checkpoint(checkpoint_name)
+                    if force_all:
+                        self._write_checkpoint(checkpoint_name, None)
+                    elif checkpoint and not checkpoint['complete']:
+                        resumed_files.append(checkpoint['files'])
                 if data_file:
                     # if entry has been set before (if we saw .result first)
                     # avoid overwriting the result file value
                     files[data_file] = files.get(data_file) or result_file
-            selected_files = [path.join(operations_folder, f) for f, data in files.items() if not data or force_all]
-            self._reset()
+            interrupted_files = set(chain.from_iterable(resumed_files))
+            selected_files = [path.join(operations_folder, f) for f, data in files.items()
+                              if (not data or force_all) and path.join(operations_folder, f) not in interrupted_files]
+            if pack_size:
+                selected_files = self._pack_files(selected_files, pack_size)
+            if resumed_files:
+                logger.info('Resuming %d interrupted uploads', len(resumed_files))
+            map_function = self.map_function
+            if not map_function:
+                if self.use_threads:
+                    map_function = self.thread_map
+                elif self.use_pool:
+                    map_function = self.pool_map
+                else:
+                    map_function = multiprocessing_map
+            if map_function == self.thread_map:
+                # threads share this object, resetting it would drop the clients they have cached
+                self._operations_buffer = None
+            else:
+                self._reset()
             logger.info('Applyting map function to operation files...')
-            return list(self.map_function(self._batch_operations, selected_files))
+            return list(map_function(self._batch_operations, resumed_files + selected_files))
 
     def get_accounts(self, client_id=None):
         logger.info('Getting accounts for client_id %s...', client_id or self.client.client_customer_id)
@@ -50,6 +50,14 @@ class OperationsBuilder:
         logger.debug('Non remove operation')
         return True
 
+    def count_operations(self, operation):
+        """
+        Number of batch job operations built for `operation`, only campaigns are built to count them
+        """
+        if operation.get('object_type') == 'campaign':
+            return sum(1 for adwords_operation in self(operation) if adwords_operation)
+        return 1 if self.valid_operation(operation) else 0
+
     def cast_operation(self, operation):
         return {k: cast_to_adwords(k, v) for k, v in operation.items()}
 
@@ -1,5 +1,7 @@
 import logging
+import sqlite3
 import tempfile
+import threading
 import os
 
 logger = logging.getLogger(__name__)
@@ -19,6 +21,12 @@ class FilesystemStorage:
         os.makedirs(os.path.dirname(full_name), exist_ok=True)
         return open(full_name, mode=mode, *args, **kwargs)
 
+    def replace(self, name, new_name):
+        """
+        Atomically rename the file `name` to `new_name`, replacing it if it exists
+        """
+        os.replace(os.path.join(self.workdir, name), os.path.join(self.workdir, new_name))
+
     def listdir(self, path):
         dirnames, filenames = [], []
         for _, dirnames, filenames in os.walk(os.path.join(self.workdir, path)):
@@ -38,3 +46,68 @@ class TemporaryFilesystemStorage(FilesystemStorage):
         if not self._workdir:
             self._workdir = tempfile.TemporaryDirectory()
         return self._workdir.name
+
+
+class IdMappingStore:
+    """
+    Real ids of the entities created with temporary ids, in an SQLite database
+
+    Ids are keyed by scope (the operations folder of the batch jobs that created the entities, as temporary ids
+    are only unique within a run), client_id, the entry field holding the temporary id (campaign_id, adgroup_id...)
+    and the temporary id itself. Every thread uses its own connection.
+    """
+    # SQLite limits the number of parameters of a statement
+    max_query_ids = 500
+
+    def __init__(self, database):
+        self.database = database
+        self.local = threading.local()
+
+    def __getstate__(self):
+        return {'database': self.database}
+
+    def __setstate__(self, state):
+        self.__init__(state['database'])
+
+    @property
+    def connection(self):
+        if not getattr(self.local, 'connection', None):
+            os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+            connection = sqlite3.connect(self.database, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS id_mapping ('
+                               'scope TEXT NOT NULL, client_id INTEGER NOT NULL, field TEXT NOT NULL, '
+                               'temp_id INTEGER NOT NULL, real_id INTEGER NOT NULL, '
+                               'PRIMARY KEY (scope, client_id, field, temp_id)) WITHOUT ROWID')
+            self.local.connection = connection
+        return self.local.connection
+
+    def add(self, mappings):
+        """
+        Store (scope, client_id, field, temp_id, real_id) tuples, replacing previous ids of the same temporary ids
+        """
+        with self.connection as connection:
+            connection.executemany('INSERT OR REPLACE INTO id_mapping VALUES (?, ?, ?, ?, ?)', mappings)
+
+    def get_many(self, scope, client_id, field, temp_ids):
+        """
+        Dict of the given temporary ids to their real ids, temporary ids without a real id are left out
+        """
+        temp_ids = list(temp_ids)
+        result = {}
+        for i in range(0, len(temp_ids), self.max_query_ids):
+            chunk = temp_ids[i:i + self.max_query_ids]
+            query = ('SELECT temp_id, real_id FROM id_mapping '
+                     'WHERE scope = ? AND client_id = ? AND field = ? AND temp_id IN ({})')
+            result.update(self.connection.execute(query.format(', '.join('?' * len(chunk))),
+                                                  [scope, client_id, field] + chunk))
+        return result
+
+    def get(self, scope, client_id, field, temp_id):
+        return self.get_many(scope, client_id, field, [temp_id]).get(temp_id)
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection:
+            connection.close()
+            self.local.connection = None
@@ -1,29 +1,274 @@
+import io
 import logging
 import csv
-import tempfile
-import gzip
-from collections import OrderedDict
+import queue
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 logger = logging.getLogger(__name__)
 
 
-def gunzip(compressed_stream):
-    with tempfile.NamedTemporaryFile(mode='wb+') as file:
-        for line in compressed_stream:
-            file.write(line)
-        file_name = file.name
-        file.flush()
-        decompressed_file = gzip.open(file_name, 'rt')
-    return decompressed_file
+class _GzipStream(io.RawIOBase):
+    """
+    Decompressed bytes of a gzip stream, decompressed as they are read.
+
+    `compressed_stream` can be a file like object (an HTTP response) or an iterable of bytes. Concatenated gzip
+    members are read one after the other, as gzip does. Closing it closes `compressed_stream`.
+    """
+    def __init__(self, compressed_stream, chunk_size=64 * 1024):
+        self.compressed_stream = compressed_stream
+        read = getattr(compressed_stream, 'read', None)
+        self.chunks = iter(lambda: read(chunk_size), b'') if read else iter(compressed_stream)
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self):
+        for chunk in self.chunks:
+            if chunk:
+                return chunk
+        return b''
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        data = b''
+        while not data:
+            if self.decompressor.unconsumed_tail:
+                compressed = self.decompressor.unconsumed_tail
+            elif self.decompressor.eof:
+                compressed = self.decompressor.unused_data or self._next_chunk()
+                # like gzip, ignore the zero padding that may follow the last member
+                if not compressed.strip(b'\x00'):
+                    return 0
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                compressed = self._next_chunk()
+                if not compressed:
+                    raise EOFError('Compressed stream ended before the end-of-stream marker was reached')
+            data = self.decompressor.decompress(compressed, size)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            close = getattr(self.compressed_stream, 'close', None)
+            if close:
+                close()
+        super().close()
+
+
+def gunzip(compressed_stream, encoding='utf-8', buffer_size=io.DEFAULT_BUFFER_SIZE * 16):
+    """
+    Text stream of the decompressed contents of the gzip `compressed_stream`, decompressed while it is read
+    """
+    return io.TextIOWrapper(io.BufferedReader(_GzipStream(compressed_stream), buffer_size), encoding=encoding,
+                            newline='')
+
+
+def _row_maker(fields, row_factory):
+    if row_factory == 'dict':
+        return lambda values: OrderedDict(zip(fields, values))
+    if row_factory == 'namedtuple':
+        return namedtuple('ReportRow', fields, rename=True)._make
+    if row_factory == 'tuple':
+        return tuple
+    raise ValueError('Unknown row factory: {}'.format(row_factory))
 
 
-def csv_reader(data_stream, fields, converter=None):
-    if converter:
-        converter = [converter.get(field, lambda x: x) for field in fields]
+def csv_reader(data_stream, fields, converter=None, row_factory='dict'):
+    """
+    Function iterating over the rows of the CSV `data_stream`, with the values of `fields` converted by the
+    functions in the `converter` dict.
+
+    `row_factory` is the type of the rows: 'dict' (an OrderedDict per row), 'namedtuple' (a namedtuple type
+    generated for `fields`, which is several times smaller than a dict and still allows access by field name)
+    or 'tuple' (plain tuples of the values, in the order of `fields`).
+    """
+    make_row = _row_maker(fields, row_factory)
+    converters = [(position, converter[field]) for position, field in enumerate(fields)
+                  if converter and field in converter]
 
     def fields_iterator():
         for line in csv.reader(data_stream):
-            yield OrderedDict(zip(fields, map(lambda x, y: x(y), converter, line)))
+            for position, convert in converters:
+                line[position] = convert(line[position])
+            yield make_row(line)
 
     return fields_iterator
+
+
+# array typecodes of the report field types stored as numbers, other fields are stored as dictionary encoded strings
+COLUMN_TYPECODES = {
+    'Money': 'd',
+    'Bid': 'd',
+    'Double': 'd',
+    'Long': 'q',
+    'Integer': 'q',
+}
+
+
+class DictionaryColumn:
+    """
+    Column of values stored as an array of codes indexing the list of its distinct values
+    """
+    def __init__(self):
+        self.codes = array('i')
+        self.values = []
+        self.index = {}
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def extend(self, values):
+        index = self.index
+        codes = []
+        for value in values:
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(self.values)
+                self.values.append(value)
+            codes.append(code)
+        self.codes.extend(codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        return self.values[self.codes[position]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+
+class ReportColumns:
+    """
+    Report rows stored column by column.
+
+    Fields whose type (`types` maps fields to report field types) is in COLUMN_TYPECODES are stored in a typed
+    array.array, every other field in a DictionaryColumn. `to_numpy` exports the typed columns without copying
+    their data.
+    """
+    def __init__(self, fields, types=None):
+        types = types or {}
+        self.columns = OrderedDict()
+        for field in fields:
+            typecode = COLUMN_TYPECODES.get(types.get(field))
+            self.columns[field] = array(typecode) if typecode else DictionaryColumn()
+
+    @property
+    def fields(self):
+        return list(self.columns)
+
+    def extend(self, rows, batch_size=10000):
+        """
+        Append `rows`, tuples of values in the order of `fields`
+        """
+        rows = iter(rows)
+        columns = list(self.columns.values())
+        batch = list(islice(rows, batch_size))
+        while batch:
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+            batch = list(islice(rows, batch_size))
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __iter__(self):
+        return zip(*self.columns.values())
+
+    def to_numpy(self, field):
+        """
+        Column `field` as a numpy array, sharing the memory of the typed columns (which cannot be extended while
+        the array is alive).
+
+        Dictionary encoded columns are returned as an object array with one value per row.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required to export report columns')
+        column = self.columns[field]
+        if isinstance(column, DictionaryColumn):
+            return numpy.array(column.values, dtype=object)[numpy.frombuffer(column.codes, dtype=numpy.intc)]
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+
+_PIPELINE_END = object()
+
+
+def pipeline(items, *stages, maxsize=1):
+    """
+    Pass every item through `stages`, each stage running in its own thread.
+
+    Stages are connected by queues holding at most `maxsize` items, so a slow stage makes the previous ones wait
+    instead of piling up work in memory. The results of the last stage are discarded. The first exception raised
+    by a stage (or by the iteration over `items`) stops every stage and is raised again here.
+    """
+    queues = [queue.Queue(maxsize) for _ in stages]
+    failed = threading.Event()
+
+    def put(target, item):
+        while not failed.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(source):
+        while not failed.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _PIPELINE_END
+
+    def run(stage, source, target):
+        try:
+            item = get(source)
+            while item is not _PIPELINE_END:
+                result = stage(item)
+                if target is not None and not put(target, result):
+                    return
+                item = get(source)
+            if target is not None:
+                put(target, _PIPELINE_END)
+        except BaseException:
+            failed.set()
+            raise
+
+    with ThreadPoolExecutor(len(stages)) as executor:
+        futures = [executor.submit(run, stage, source, target)
+                   for stage, source, target in zip(stages, queues, queues[1:] + [None])]
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    break
+            put(queues[0], _PIPELINE_END)
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            for future in futures:
+                future.result()
@@ -1,10 +1,26 @@
+import gzip
+import json
 import logging
 from pprint import pprint
 
-from adwords_client.client import AdWords
-from adwords_client import reports
+from adwords_client.client import AdWords, JobPollScheduler, _ReportRows
+from adwords_client import buffers, reports, storages, utils
+from adwords_client.adwords_api.batch_job_service import (BatchJobHelper, BatchJobService, ChunkSizer,
+                                                          OperationsSerializer, iter_results)
+from adwords_client.adwords_api.common import RetryPolicy
+from adwords_client.adwords_api.serializers import (UPLOAD_PREFIX, UPLOAD_SUFFIX, TemplateSerializer,
+                                                    build_range_request, build_upload_request)
 from adwords_client.internal_api.builder import OperationsBuilder
+from array import array
+from collections import OrderedDict
 from datetime import datetime
+from itertools import chain, product
+from io import BytesIO, StringIO
+from os import path
+from threading import Barrier, get_ident
+from types import SimpleNamespace
+from urllib.error import HTTPError
+from xml.etree import ElementTree
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('googleads').setLevel(logging.ERROR)
@@ -93,9 +109,9 @@ def _get_keywords_report(client=None):
     return report_df
 
 
-def _get_adgroups_report(client=None):
+def _get_adgroups_report(client=None, **kwargs):
     client = client or AdWords()
-    report_df = reports.get_adgroups_report(client, 7857288943, 'CampaignStatus = "PAUSED"', fields=True)
+    report_df = reports.get_adgroups_report(client, 7857288943, 'CampaignStatus = "PAUSED"', fields=True, **kwargs)
     return report_df
 
 
@@ -1131,6 +1147,9 @@ def test_client():
     assert kw_report[0]['CpcBid'] == 4.20
     adg_report = _get_adgroups_report()
     assert adg_report[0]['CpcBid'] == 4.20
+    adg_stream = _get_adgroups_report(stream=True)
+    assert next(adg_stream) == adg_report[0]
+    adg_stream.close()
     _assert_jobs(_delete_campaigns())
 
 
@@ -1146,3 +1165,905 @@ def test_get_accounts():
 def test_batchjobs():
     client = AdWords()
     list(client.get_batchjobs())
+
+
+def test_buffer_codecs():
+    entries = [
+        {'object_type': 'keyword', 'client_id': 7857288943, 'adgroup_id': -2, 'cpc_bid': 4.2, 'text': 'ação'},
+        OrderedDict([('object_type', 'campaign'), ('client_id', 7857288943), ('locations', [1001773, 1001768])]),
+    ]
+    for codec in [buffers.JsonCodec(), buffers.MarshalCodec()]:
+        buffer = buffers.OperationsBuffer(codec, spill_threshold=300)
+        for entry in entries:
+            buffer.write(entry)
+        assert buffer.in_memory
+        assert list(buffer) == entries
+        buffer.write_many(entries)
+        assert not buffer.in_memory
+        assert list(buffer) == entries + entries
+
+
+def test_read_operations_codecs():
+    client = AdWords()
+    entries = [{'object_type': 'keyword', 'client_id': 7857288943, 'adgroup_id': -2, 'text': 'ação'},
+               {'object_type': 'keyword', 'client_id': 7857288943, 'adgroup_id': -2, 'text': '{"a": 1}'}]
+    for entry in entries:
+        client._write_entry('folder/marshal.data', entry, client.codec)
+        client._write_entry('folder/json.data', entry, buffers.JSON_CODEC)
+    client.flush_files()
+    assert list(client._read_operations('folder/marshal.data')) == entries
+    assert list(client._read_operations('folder/json.data')) == entries
+
+
+def test_open_files_cache():
+    client = AdWords(max_open_files=2, max_pending_writes=1)
+    names = ['folder/{}.data'.format(n) for n in range(3)]
+    for row in range(4):
+        for name in names:
+            client._write_entry(name, {'row': row})
+            assert len(client.open_files) <= 2
+    # the least recently used file was closed, and is appended to when written again
+    assert list(client.open_files) == names[1:]
+    assert client.evicted_files == set(names)
+    client.flush_files()
+    assert not client.open_files and not client.evicted_files
+    for name in names:
+        assert [entry['row'] for entry in client._read_entries(name)] == [0, 1, 2, 3]
+    # files written again after a flush are truncated
+    client._write_entry(names[0], {'row': 4})
+    client.flush_files()
+    assert list(client._read_entries(names[0])) == [{'row': 4}]
+
+
+def test_pool_map():
+    client = AdWords(use_pool=True, pool_size=2)
+    names = ['folder/{}.checkpoint'.format(n) for n in range(3)]
+    for n, name in enumerate(names):
+        client._write_checkpoint(name, {'n': n})
+    with client:
+        assert client.pool_map(client._read_checkpoint, names) == [{'n': 0}, {'n': 1}, {'n': 2}]
+        pool = client._pool
+        assert client.pool_map(client._read_checkpoint, names[:1]) == [{'n': 0}]
+        assert client._pool is pool
+        # workers copy the object when the pool is created, a new storage reaches them once the pool is closed
+        client.storage = storages.TemporaryFilesystemStorage()
+        client._write_checkpoint(names[0], {'n': 3})
+        client.close()
+        assert client._pool is None
+        assert client.pool_map(client._read_checkpoint, names) == [{'n': 3}, None, None]
+    assert client._pool is None
+
+
+def test_thread_map():
+    client = AdWords(pool_size=1, max_threads=3)
+    barrier = Barrier(3, timeout=10)
+
+    def work(item):
+        # returns once three threads are running at the same time
+        barrier.wait()
+        client.local.item = item
+        return item, get_ident(), client.local.item
+
+    with client:
+        results = client.thread_map(work, range(6))
+        assert [(item, local_item) for item, _, local_item in results] == [(n, n) for n in range(6)]
+        assert len({ident for _, ident, _ in results}) == 3
+        thread_pool = client.thread_pool
+        client.thread_map(work, range(3))
+        assert client.thread_pool is thread_pool
+    assert client._thread_pool is None
+
+
+def test_insert_columns():
+    client = AdWords()
+    client.insert_columns(
+        'keyword',
+        client_id=7857288943,
+        operator='SET',
+        adgroup_id=array('q', [10, 11, -3]),
+        criteria_id=[20, None, 22],
+        cpc_bid=array('d', [4.2, 1.5, -7.0]),
+    )
+    entries = list(client._read_buffer())
+    assert len(entries) == 3
+    assert entries[1] == {'object_type': 'keyword', 'client_id': 7857288943, 'operator': 'SET',
+                          'adgroup_id': 11, 'criteria_id': None, 'cpc_bid': 1.5}
+    assert client.min_id == -3
+
+
+def test_sort_operations():
+    client = AdWords(spill_threshold=0)
+    object_types = ['keyword', 'attach_label', 'campaign', 'adgroup', 'ad', 'campaign', 'keyword', 'adgroup']
+    entries = [{'object_type': object_type, 'client_id': client_id, 'n': n}
+               for n, (object_type, client_id) in enumerate(product(object_types, [2, 1]))]
+    client.insert(entries)
+    client.sort_operations(max_entries_in_memory=3)
+    levels = {'campaign': 1, 'adgroup': 2, 'keyword': 3, 'ad': 3, 'attach_label': 4}
+    expected = sorted(entries, key=lambda entry: (entry['client_id'], levels[entry['object_type']], entry['n']))
+    assert list(client._read_buffer()) == expected
+
+
+def test_pack_files():
+    client = AdWords()
+    for campaign_id in (-1, -2, -3):
+        client.insert({'object_type': 'campaign', 'client_id': 7857288943, 'campaign_id': campaign_id,
+                       'budget': 1000, 'campaign_name': 'c{}'.format(campaign_id), 'locations': [1001773, 1001768],
+                       'languages': [1014], 'status': 'PAUSED'})
+        client.insert({'object_type': 'keyword', 'client_id': 7857288943, 'campaign_id': campaign_id,
+                       'adgroup_id': campaign_id - 10, 'text': 'k', 'keyword_match_type': 'broad'})
+    operations_folder = client.split()
+    # budget, campaign, language, two locations and the keyword
+    assert client._read_summary(operations_folder)['-1.data'] == [7857288943, 6]
+    files = [path.join(operations_folder, '{}.data'.format(campaign_id)) for campaign_id in (-1, -2, -3)]
+    assert client._summarize_file(files[0]) == (7857288943, 6)
+    assert client._pack_files(files, 12) == [sorted(files)[:2], sorted(files)[2:]]
+    assert client._pack_files(files, 11) == [[name] for name in sorted(files)]
+
+
+class _BatchJobService:
+    """
+    Stores the bytes uploaded to every job as the upload server does, refusing requests that do not start where the
+    stored bytes end. The `fail_at`-th send fails before reaching the server, the `crash_at`-th one after the server
+    stored it, as if the process died in either place.
+    """
+    def __init__(self, fail_at=None, crash_at=None):
+        self.client = SimpleNamespace(client_customer_id=None)
+        self.operations_serializer = SimpleNamespace(serialize=lambda operations: json.dumps(operations) + '\n')
+        self.helper = self
+        self.stored = OrderedDict()
+        self.complete = set()
+        self.fail_at = fail_at
+        self.crash_at = crash_at
+        self.sends = 0
+        self.payloads = []
+
+    @property
+    def jobs(self):
+        return OrderedDict((job_id, [operation for line in data.decode('utf-8').splitlines() if line.strip()
+                                     for operation in chain.from_iterable(json.loads(line))])
+                           for job_id, data in self.stored.items())
+
+    def prepare_job(self, client_id):
+        job = {'id': len(self.stored) + 1, 'upload_url': 'http://upload', 'status': 'ACTIVE'}
+        self.resume_job(job, {'length': 0}, client_id)
+
+    def resume_job(self, job, upload_helper, client_id):
+        self.client.client_customer_id = client_id
+        self.job = job
+        self.length = upload_helper['length']
+        self.stored.setdefault(job['id'], b'')
+
+    def dump_upload_helper(self):
+        return {'length': self.length}
+
+    def build_request(self, operations_xml, is_last=False):
+        # padded as every increment but the last one
+        data = operations_xml if is_last else operations_xml + b' ' * 1024
+        return SimpleNamespace(start=self.length, data=data, operations_xml=operations_xml)
+
+    def send(self, request, is_last=False, check_committed=False):
+        self.sends += 1
+        if self.sends == self.fail_at:
+            raise RuntimeError('upload failed')
+        job_id = self.job['id']
+        start, data = request.start, request.data
+        if check_committed:
+            committed = len(self.stored[job_id])
+            if job_id in self.complete or committed >= start + len(data):
+                data = b''
+            else:
+                data, start = data[committed - start:], committed
+        if data:
+            assert start == len(self.stored[job_id]), 'the upload does not continue the stored bytes'
+            self.stored[job_id] += data
+            self.payloads.append(len(request.operations_xml))
+            if is_last:
+                self.complete.add(job_id)
+        self.length = request.start + len(request.data)
+        if self.sends == self.crash_at:
+            raise RuntimeError('process died')
+
+
+def _split_campaigns(**kwargs):
+    client = AdWords(**kwargs)
+    for client_id, campaign_id in ((7857288943, -1), (7857288944, -2)):
+        client.insert({'object_type': 'campaign', 'client_id': client_id, 'campaign_id': campaign_id,
+                       'budget': 1000, 'campaign_name': 'c', 'languages': [1014], 'status': 'PAUSED'})
+        client.insert({'object_type': 'keyword', 'client_id': client_id, 'campaign_id': campaign_id,
+                       'adgroup_id': campaign_id - 10, 'text': 'k', 'keyword_match_type': 'broad'})
+    operations_folder = client.split()
+    return client, [path.join(operations_folder, '{}.data'.format(campaign_id)) for campaign_id in (-1, -2)]
+
+
+def test_resume_batch_operations():
+    uploads = []
+    client, files = _split_campaigns(chunk_size_hook=lambda *upload: uploads.append(upload))
+    expected = client.services['BatchJobService'] = _BatchJobService()
+    client._batch_operations(files)
+    # budget, campaign and language of the campaign and the keyword, in a job per client
+    assert [len(operations) for operations in expected.jobs.values()] == [4, 4]
+    # chunks are sized from the operations, without the padding of the requests
+    assert [upload[:2] for upload in uploads] == [(4, expected.payloads[0]), (4, expected.payloads[1])]
+
+    client, files = _split_campaigns()
+    bjs = client.services['BatchJobService'] = _BatchJobService(fail_at=1)
+    try:
+        client._batch_operations(files)
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'the upload did not fail'
+    assert bjs.jobs == OrderedDict([(1, [])])
+    # a new process resumes the upload, the temporary ids must not depend on its min_id
+    rerun = AdWords(storage=client.storage)
+    rerun.services['BatchJobService'] = bjs
+    rerun._batch_operations(files)
+    assert bjs.jobs == expected.jobs
+    jobs = [entry['batchjob_id'] for name in files for entry in rerun._read_entries(name + '.result')]
+    assert sorted(set(jobs)) == [1, 2]
+    rerun._batch_operations(files)
+    assert bjs.sends == 3
+
+
+def test_resume_stored_chunk(monkeypatch):
+    from adwords_client import client as client_module
+
+    def chunk_sizer(size):
+        return lambda callback=None: ChunkSizer(initial_operations=size, min_operations=size, max_operations=size,
+                                                callback=callback)
+
+    monkeypatch.setattr(client_module, 'ChunkSizer', chunk_sizer(3))
+    client, files = _split_campaigns()
+    expected = client.services['BatchJobService'] = _BatchJobService()
+    client._batch_operations(files)
+    # two chunks per job
+    assert expected.sends == 4
+    for crash_at in range(1, 5):
+        monkeypatch.setattr(client_module, 'ChunkSizer', chunk_sizer(3))
+        client, files = _split_campaigns()
+        bjs = client.services['BatchJobService'] = _BatchJobService(crash_at=crash_at)
+        try:
+            client._batch_operations(files)
+        except RuntimeError:
+            pass
+        # the server stored the chunk, but the process died before writing the checkpoint. The rerun sizes
+        # chunks differently, yet continues the upload where the server is
+        monkeypatch.setattr(client_module, 'ChunkSizer', chunk_sizer(2))
+        rerun = AdWords(storage=client.storage)
+        rerun.services['BatchJobService'] = bjs
+        rerun._batch_operations(files)
+        assert bjs.jobs == expected.jobs and bjs.complete == {1, 2}
+
+
+def test_template_serializer():
+    builder = OperationsBuilder()
+    keyword, = builder({'object_type': 'keyword', 'client_id': 7857288943, 'operator': 'ADD', 'adgroup_id': -2,
+                       'text': 'r&d <ação>', 'keyword_match_type': 'exact', 'cpc_bid': 4.2})
+    ad, = builder({'object_type': 'ad', 'client_id': 7857288943, 'adgroup_id': -2, 'headline_part_1': 'h1',
+                  'headline_part_2': 'h2', 'description': 'd', 'final_urls': 'http://x.com'})
+    serializer = TemplateSerializer()
+    xml = serializer.serialize([[keyword], [ad]])
+    request = build_upload_request('http://upload', xml, is_last=True)
+    assert request.get_method() == 'PUT'
+    assert request.get_header('Content-range') == 'bytes 0-{0}/{1}'.format(len(request.data) - 1, len(request.data))
+    operations = list(ElementTree.fromstring(request.data))
+    ns = '{https://adwords.google.com/api/adwords/cm/v201806}'
+    assert [child.tag for child in operations[0]] == [ns + 'operator', ns + 'operand']
+    criterion = operations[0].find(ns + 'operand/' + ns + 'criterion')
+    assert criterion.get('{http://www.w3.org/2001/XMLSchema-instance}type') == 'Keyword'
+    assert [(child.tag, child.text) for child in criterion] == [(ns + 'text', 'r&d <ação>'),
+                                                              (ns + 'matchType', 'EXACT')]
+    assert request.data.endswith(b'</mutate>')
+    assert len(build_upload_request('http://upload', xml, current_content_length=262144).data) == 262144
+    assert serializer.serialize([[{'xsi_type': 'LabelOperation', 'operator': 'ADD', 'operand': {}}]]) is None
+
+
+def _xml_tree(element):
+    xsi_type = element.get('{http://www.w3.org/2001/XMLSchema-instance}type')
+    return element.tag, xsi_type, (element.text or '').strip(), [_xml_tree(child) for child in element]
+
+
+def test_template_serializer_matches_googleads():
+    client_id = 7857288943
+    entries = [
+        {'object_type': 'campaign', 'client_id': client_id, 'campaign_id': -1, 'budget': 1000,
+         'campaign_name': 'c & <d>', 'locations': [1001773], 'languages': [1014], 'status': 'PAUSED'},
+        {'object_type': 'campaign', 'client_id': client_id, 'campaign_id': 12, 'operator': 'SET', 'status': 'ENABLED'},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2, 'adgroup_name': 'a',
+         'cpc_bid': 13.37},
+        {'object_type': 'keyword', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2, 'text': 'ação',
+         'keyword_match_type': 'broad', 'status': 'PAUSED', 'cpc_bid': 13.37},
+        {'object_type': 'keyword', 'client_id': client_id, 'adgroup_id': 5, 'criteria_id': 3, 'operator': 'SET',
+         'cpc_bid': 1.5},
+        {'object_type': 'ad', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2, 'headline_part_1': 'h1',
+         'headline_part_2': 'h2', 'description': 'd', 'path_1': 'p', 'path_2': 'q',
+         'final_urls': 'http://www.x.com/', 'final_mobile_urls': 'http://m.x.com/'},
+        {'object_type': 'campaign_ad_schedule', 'client_id': client_id, 'campaign_id': 12, 'day_of_week': 'MONDAY',
+         'start_hour': 8, 'start_minute': 'ZERO', 'end_hour': 18, 'end_minute': 'THIRTY', 'bid_modifier': 1.2},
+    ]
+    request_builder = AdWords().service('BatchJobService').operations_serializer.request_builder
+    builder = OperationsBuilder()
+    serializer = TemplateSerializer()
+    for entry in entries:
+        for operation in builder(entry):
+            template_xml = serializer.serialize([[operation]])
+            # every operation type built by OperationsBuilder for batch jobs has a template
+            assert template_xml is not None, operation['xsi_type']
+            googleads_xml = request_builder._BuildUploadRequestBody([[operation]], has_prefix=False,
+                                                                    has_suffix=False)
+            template, googleads = (ElementTree.fromstring(UPLOAD_PREFIX + xml + UPLOAD_SUFFIX)
+                                   for xml in (template_xml, googleads_xml))
+            assert _xml_tree(template) == _xml_tree(googleads), operation
+
+
+class _RequestBuilder:
+    """
+    Writes operations as googleads' upload request builder does, without namespaces
+    """
+    def _BuildUploadRequestBody(self, operations, has_prefix=True, has_suffix=True):
+        assert not has_prefix and not has_suffix
+        return ''.join('<operations xsi:type="{}"><operator>{}</operator></operations>'.format(
+            operation['xsi_type'], operation['operator']) for operations_of_type in operations
+            for operation in operations_of_type)
+
+
+def test_mixed_serializers_upload():
+    builder = OperationsBuilder()
+    budget, campaign = builder({'object_type': 'campaign', 'client_id': 7857288943, 'campaign_id': -1,
+                                'budget': 1000, 'campaign_name': 'c', 'status': 'PAUSED'})
+    label = {'xsi_type': 'CampaignLabelOperation', 'operator': 'ADD', 'operand': {'campaignId': -1, 'labelId': 9}}
+    serializer = OperationsSerializer(_RequestBuilder())
+    ns = '{https://adwords.google.com/api/adwords/cm/v201806}'
+    xsi_type = '{http://www.w3.org/2001/XMLSchema-instance}type'
+    for chunks in ([[[budget]], [[label]], [[campaign]]], [[[budget], [campaign]], [[label]]]):
+        data = b''
+        for position, chunk in enumerate(chunks):
+            data += build_upload_request('http://upload', serializer.serialize(chunk), current_content_length=len(data),
+                                         is_last=position == len(chunks) - 1).data
+        mutate = ElementTree.fromstring(data)
+        assert mutate.tag == ns + 'mutate'
+        assert [(child.tag, child.get(xsi_type)) for child in mutate] == [
+            (ns + 'operations', operation['xsi_type']) for chunk in chunks for operations in chunk
+            for operation in operations]
+
+
+class _UploadOpener:
+    """
+    Upload server keeping the bytes of an incremental upload. `failures` holds, for every PUT in turn, how many of
+    its bytes are stored before the connection drops (None for a PUT that goes through).
+    """
+    def __init__(self, stored=b'', failures=()):
+        self.stored = stored
+        self.complete = False
+        self.failures = list(failures)
+        self.puts = []
+
+    def open(self, request):
+        content_range = request.get_header('Content-range')
+        if content_range == 'bytes */*':
+            if self.complete:
+                return SimpleNamespace(code=200)
+            headers = {'Range': 'bytes=0-{}'.format(len(self.stored) - 1)} if self.stored else {}
+            raise HTTPError(request.full_url, 308, 'Resume Incomplete', headers, None)
+        start = int(content_range.split(' ')[1].split('-')[0])
+        self.puts.append(start)
+        if start != len(self.stored):
+            # requests that do not continue the stored bytes are refused
+            raise ConnectionResetError()
+        stored = self.failures.pop(0) if self.failures else None
+        self.stored += request.data[:stored]
+        is_last = not content_range.endswith('*')
+        self.complete = is_last and len(self.stored) == start + len(request.data)
+        if stored is not None:
+            raise ConnectionResetError()
+        if not is_last:
+            raise HTTPError(request.full_url, 308, 'Resume Incomplete', {}, None)
+        return SimpleNamespace(code=200)
+
+
+def _upload_helper(opener, start=0):
+    helper = BatchJobHelper.__new__(BatchJobHelper)
+    helper.retry_delay = 0
+    helper.upload_helper = SimpleNamespace(_upload_url='http://upload', _url_opener=opener,
+                                           _current_content_length=start, _is_last=False)
+    return helper
+
+
+def test_upload_resend():
+    data = b'x' * 600
+    # the server stored part of the request: only the rest is sent again
+    opener = _UploadOpener(failures=[250])
+    helper = _upload_helper(opener)
+    helper.send(build_range_request('http://upload', data, 0))
+    assert opener.puts == [0, 250] and opener.stored == data
+    assert helper.upload_helper._current_content_length == 600
+
+    # the server stored the whole request before the connection dropped: nothing is sent again
+    opener = _UploadOpener(failures=[600])
+    helper = _upload_helper(opener)
+    helper.send(build_range_request('http://upload', data, 0))
+    assert opener.puts == [0] and opener.stored == data
+    opener = _UploadOpener(failures=[600])
+    helper = _upload_helper(opener)
+    helper.send(build_range_request('http://upload', data, 0, is_last=True), is_last=True)
+    assert opener.puts == [0] and opener.complete
+    # a request sent by an interrupted process, already stored
+    helper = _upload_helper(_UploadOpener(stored=data))
+    helper.send(build_range_request('http://upload', data, 0), check_committed=True)
+    assert helper.upload_helper._url_opener.puts == []
+
+    # the server lost bytes sent by previous requests
+    opener = _UploadOpener(stored=data[:300])
+    helper = _upload_helper(opener, start=600)
+    try:
+        helper.send(build_range_request('http://upload', data, 600))
+    except RuntimeError as e:
+        assert 'lost data' in str(e)
+    else:
+        assert False, 'the lost data was not detected'
+
+
+def test_job_poll_scheduler():
+    scheduler = JobPollScheduler(min_sleep=15, max_sleep=600)
+    created = datetime(2018, 1, 1, 12, 0, 0)
+    job = {'batchjob_id': 1, 'creation_time': created.isoformat(), 'status': 'ACTIVE'}
+    pending = {7857288943: {1: job}}
+    now = created.timestamp() + 60
+    # no progress yet: exponential backoff
+    assert scheduler.next_sleep(pending, now) == 15
+    assert scheduler.next_sleep(pending, now) == 30
+    # 20% done one minute after creation
+    job['estimated_percent_executed'] = 20
+    assert scheduler.next_sleep(pending, now) == 240
+    # 60% done 20 seconds later: 40% per 20s since first seen
+    job['estimated_percent_executed'] = 60
+    assert scheduler.next_sleep(pending, now + 20) == 20
+    job['estimated_percent_executed'] = 99
+    assert scheduler.next_sleep(pending, now + 40) == 15
+
+
+
+class _StatusClient:
+    def __init__(self, requests):
+        self.client_customer_id = None
+        self.requests = requests
+
+    def SetClientCustomerId(self, client_customer_id):
+        self.client_customer_id = client_customer_id
+
+    def GetService(self, service_name, version=None):
+        def get(selector):
+            ids = selector['predicates'][0]['values']
+            self.requests.append((self.client_customer_id, ids))
+            return {'totalNumEntries': len(ids), 'entries': [{'id': i, 'status': 'DONE'} for i in ids]}
+        return SimpleNamespace(get=get)
+
+
+def test_get_status():
+    requests = []
+    client = _StatusClient(requests)
+    client.SetClientCustomerId(7857288943)
+    bjs = BatchJobService(client)
+    assert bjs.get_status(1) == {'id': 1, 'status': 'DONE'}
+    assert bjs.get_status(2, 1234) == {'id': 2, 'status': 'DONE'}
+    assert requests == [(7857288943, [1]), (1234, [2])]
+
+
+def test_get_multiple_status():
+    requests = []
+    bjs = BatchJobService(_StatusClient(requests))
+    jobs = {1: list(range(5)), 2: [10, 11], 3: []}
+    result = bjs.get_multiple_status(jobs, max_workers=2, ids_per_request=2)
+    assert result == {client_id: [{'id': i, 'status': 'DONE'} for i in ids] for client_id, ids in jobs.items()}
+    assert sorted(requests) == [(1, [0, 1]), (1, [2, 3]), (1, [4]), (2, [10, 11])]
+    # the status requests go through per-thread copies of the client
+    assert bjs.client.client_customer_id is None
+
+def test_jobs_journal():
+    client = AdWords()
+    client_id = 7857288943
+    client._append_entries('jobs/-1.data.result', [
+        {'client_id': client_id, 'batchjob_id': batchjob_id, 'upload_url': '', 'result_url': '', 'metadata': '',
+         'creation_time': datetime(2018, 1, 1).isoformat(), 'status': 'ACTIVE'} for batchjob_id in (1, 2, 3)])
+    done = {'client_id': client_id, 'batchjob_id': 1, 'status': 'DONE', 'result_url': 'http://result/1'}
+    running = {'client_id': client_id, 'batchjob_id': 2, 'status': 'ACTIVE', 'result_url': ''}
+    client._compact_jobs_journal('jobs', {'pending': {client_id: {2: running}}, 'done': {client_id: {1: done}}})
+    client._append_jobs_journal('jobs', [dict(running, status='DONE', result_url='http://result/2'),
+                                         {'client_id': client_id, 'batchjob_id': 3, 'status': 'ACTIVE',
+                                          'result_url': '', 'estimated_percent_executed': 50}])
+    with client.storage.open('jobs/jobs.journal', mode='a') as file:
+        file.write('{"client_id": 7857288943, "batchjob_id": 3, "sta')
+
+    jobs = client._collect_jobs('jobs')
+    assert sorted(jobs['done'][client_id]) == [1, 2]
+    assert jobs['done'][client_id][2]['result_url'] == 'http://result/2'
+    assert list(jobs['pending'][client_id]) == [3]
+    assert jobs['pending'][client_id][3]['estimated_percent_executed'] == 50
+
+    polled = []
+
+    def get_multiple_status(pending):
+        polled.append({client: sorted(job_ids) for client, job_ids in pending.items()})
+        return {client_id: [{'id': 3, 'status': 'DONE', 'downloadUrl': {'url': 'http://result/3'}}]}
+
+    client.services['BatchJobService'] = SimpleNamespace(get_multiple_status=get_multiple_status)
+    jobs = client.wait_jobs('jobs')
+    # finished jobs are not polled again
+    assert polled == [{client_id: [3]}]
+    assert not jobs['pending'] and sorted(jobs['done'][client_id]) == [1, 2, 3]
+    # the journal was compacted into the snapshot
+    with client.storage.open('jobs/jobs.journal', mode='r') as file:
+        assert file.read() == ''
+    assert {batchjob_id: job['status'] for batchjob_id, job in client._read_jobs_journal('jobs').items()} == {
+        1: 'DONE', 2: 'DONE', 3: 'DONE'}
+    client.wait_jobs('jobs')
+    assert len(polled) == 1
+
+
+def test_jobs_journal_compaction_crash(monkeypatch):
+    client = AdWords()
+    client_id = 7857288943
+    done = {'client_id': client_id, 'batchjob_id': 1, 'status': 'DONE', 'result_url': 'http://result/1'}
+    client._compact_jobs_journal('jobs', {'pending': {}, 'done': {client_id: {1: done}}})
+    client._append_jobs_journal('jobs', [{'client_id': client_id, 'batchjob_id': 2, 'status': 'ACTIVE',
+                                          'result_url': ''}])
+
+    def crash(name, new_name):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(client.storage, 'replace', crash)
+    try:
+        client._compact_jobs_journal('jobs', {'pending': {}, 'done': {}})
+    except KeyboardInterrupt:
+        pass
+    # neither the snapshot nor the journal were touched
+    assert {batchjob_id: job['status'] for batchjob_id, job in client._read_jobs_journal('jobs').items()} == {
+        1: 'DONE', 2: 'ACTIVE'}
+
+
+def test_iter_results():
+    results = BytesIO(
+        b'<ns2:mutateResponse xmlns="https://adwords.google.com/api/adwords/cm/v201806" '
+        b'xmlns:ns2="https://adwords.google.com/api/adwords/cm/v201806" '
+        b'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><rval>'
+        b'<MutateResult><result><Campaign><id>123</id><name>c</name></Campaign></result><index>0</index></MutateResult>'
+        b'<MutateResult><result><AdGroupCriterion><adGroupId>5</adGroupId><criterion xsi:type="Keyword"><id>77</id>'
+        b'</criterion></AdGroupCriterion></result><index>1</index></MutateResult>'
+        b'<MutateResult><errorList><errors xsi:type="EntityNotFound"><fieldPath>operations[2]</fieldPath>'
+        b'<reason>INVALID_ID</reason></errors></errorList><index>2</index></MutateResult>'
+        b'</rval></ns2:mutateResponse>'
+    )
+    assert list(iter_results(results)) == [
+        {'index': 0, 'type': 'Campaign', 'id': 123, 'errors': []},
+        {'index': 1, 'type': 'AdGroupCriterion', 'id': 77, 'errors': []},
+        {'index': 2, 'type': None, 'id': None, 'errors': [{'fieldPath': 'operations[2]', 'reason': 'INVALID_ID'}]},
+    ]
+
+
+def test_id_mapping():
+    client = AdWords()
+    client.id_mapping.add([('ops', 7857288943, 'campaign_id', -1, 1001), ('ops', 7857288943, 'adgroup_id', -2, 2002),
+                           ('ops', 1111111111, 'adgroup_id', -3, 3003), ('old', 7857288943, 'adgroup_id', -3, 4004)])
+    assert client.id_mapping.get('ops', 7857288943, 'campaign_id', -1) == 1001
+    assert client.id_mapping.get_many('ops', 7857288943, 'adgroup_id', [-2, -3]) == {-2: 2002}
+    entries = [
+        {'object_type': 'adgroup', 'client_id': 7857288943, 'campaign_id': -1, 'adgroup_id': -4},
+        {'object_type': 'keyword', 'client_id': 7857288943, 'adgroup_id': -2, 'text': 'k'},
+    ]
+    client.insert(entries, map_ids=True, operations_folder='ops')
+    assert list(client._read_buffer()) == [
+        {'object_type': 'adgroup', 'client_id': 7857288943, 'campaign_id': 1001, 'adgroup_id': -4},
+        {'object_type': 'keyword', 'client_id': 7857288943, 'adgroup_id': 2002, 'text': 'k'},
+    ]
+    assert entries[0]['campaign_id'] == -1
+    assert client.min_id == -4
+
+
+def test_id_mapping_new_entities():
+    client = AdWords()
+    client_id = 7857288943
+    client.id_mapping.add([('ops', client_id, 'campaign_id', -1, 1001), ('ops', client_id, 'adgroup_id', -2, 2002)])
+    # a later run reusing the same temporary ids for new entities
+    entries = [
+        {'object_type': 'campaign', 'client_id': client_id, 'campaign_id': -1},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2, 'operator': 'SET'},
+    ]
+    client.insert(entries, map_ids=True, operations_folder='ops')
+    # the ids of the entities being added are kept, references to existing entities are mapped
+    assert list(client._read_buffer()) == [
+        {'object_type': 'campaign', 'client_id': client_id, 'campaign_id': -1},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': 1001, 'adgroup_id': -2},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': 1001, 'adgroup_id': 2002,
+         'operator': 'SET'},
+    ]
+    # mappings of other operations folders are not used
+    client = AdWords(storage=client.storage)
+    client.insert(entries, map_ids=True, operations_folder='other')
+    assert list(client._read_buffer()) == entries
+
+
+def _results_response(results):
+    raw = BytesIO(
+        b'<ns2:mutateResponse xmlns="https://adwords.google.com/api/adwords/cm/v201806" '
+        b'xmlns:ns2="https://adwords.google.com/api/adwords/cm/v201806"><rval>' +
+        b''.join('<MutateResult><result><{0}><{1}>{2}</{1}></{0}></result><index>{3}</index></MutateResult>'.format(
+            type_name, 'budgetId' if type_name == 'Budget' else 'id', entity_id, index).encode('utf-8')
+            for index, (type_name, entity_id) in enumerate(results)) +
+        b'</rval></ns2:mutateResponse>'
+    )
+    return SimpleNamespace(raw=raw, raise_for_status=lambda: None, close=raw.close)
+
+
+def test_download_results(monkeypatch):
+    client = AdWords()
+    client_id = 7857288943
+    client._append_entries('ops/1.data', [
+        {'object_type': 'campaign', 'client_id': client_id, 'campaign_id': -1},
+        {'object_type': 'adgroup', 'client_id': client_id, 'campaign_id': -1, 'adgroup_id': -2},
+    ])
+    # the campaign entry was built into a budget and a campaign operation
+    client._write_job_index('ops', 11, 0, [('ops/1.data', 0), ('ops/1.data', 0), ('ops/1.data', 1)])
+    results = {'http://result/11': [('Budget', 500), ('Campaign', 1001), ('AdGroup', 2002)]}
+    monkeypatch.setattr('adwords_client.client.requests.get',
+                        lambda url, stream=False: _results_response(results[url]))
+
+    assert client._reconcile_job(('ops', {'client_id': client_id, 'batchjob_id': 11,
+                                          'result_url': 'http://result/11'})) == 3
+    assert [(outcome['entry'], outcome['index'], outcome['type'], outcome['id'])
+            for outcome in client._read_entries('ops/1.data.11.outcome')] == [
+        (0, 0, 'Budget', 500), (0, 1, 'Campaign', 1001), (1, 2, 'AdGroup', 2002)]
+    assert client.id_mapping.get('ops', client_id, 'campaign_id', -1) == 1001
+    assert client.id_mapping.get('ops', client_id, 'adgroup_id', -2) == 2002
+
+    # jobs without an index (uploaded by an older version or a custom map_function) are skipped
+    jobs = {'pending': {}, 'done': {client_id: {
+        11: {'client_id': client_id, 'batchjob_id': 11, 'result_url': 'http://result/11'},
+        12: {'client_id': client_id, 'batchjob_id': 12, 'result_url': 'http://result/12'},
+        13: {'client_id': client_id, 'batchjob_id': 13, 'result_url': ''},
+    }}}
+    assert client.download_results('ops', jobs) == {11: 3, 12: None}
+
+class _ServerFault(Exception):
+    def __init__(self, *errors):
+        super().__init__('fault')
+        self.errors = list(errors)
+
+
+def test_retry_policy():
+    policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=10, rate_exceeded_delay=30)
+    rate_exceeded = _ServerFault({'ApiError.Type': 'RateExceededError', 'reason': 'RATE_EXCEEDED',
+                                  'retryAfterSeconds': 45})
+    internal = _ServerFault({'ApiError.Type': 'InternalApiError', 'reason': 'UNEXPECTED_INTERNAL_API_ERROR'})
+    permanent = _ServerFault({'ApiError.Type': 'InternalApiError', 'reason': 'TRANSIENT_ERROR'},
+                             {'ApiError.Type': 'CriterionError', 'reason': 'INVALID_KEYWORD_TEXT'})
+    assert policy.classify(rate_exceeded) == RetryPolicy.RATE_EXCEEDED
+    assert 45 <= policy.get_delay(rate_exceeded, 1) <= 46
+    assert policy.classify(internal) == RetryPolicy.TRANSIENT
+    assert 0 <= policy.get_delay(internal, 2) <= 2
+    assert policy.get_delay(internal, 3) is None
+    assert policy.classify(ConnectionResetError()) == RetryPolicy.TRANSIENT
+    assert policy.classify(permanent) == RetryPolicy.PERMANENT
+    assert policy.get_delay(permanent, 1) is None
+    assert policy.get_delay(ValueError(), 1) is None
+    assert 45 <= policy.get_resend_delay(rate_exceeded.errors, 1) <= 46
+    assert policy.get_resend_delay(permanent.errors, 1) is None
+    assert policy.is_retryable({'ApiError.Type': 'DatabaseError', 'reason': 'CONCURRENT_MODIFICATION'})
+    assert not policy.is_retryable({'ApiError.Type': 'CriterionError', 'reason': 'INVALID_KEYWORD_TEXT'})
+
+    calls = []
+
+    def _fail_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _ServerFault({'ApiError.Type': 'DatabaseError', 'reason': 'CONCURRENT_MODIFICATION'})
+        return 'ok'
+
+    assert RetryPolicy(base_delay=0).call(_fail_once) == 'ok'
+    assert len(calls) == 2
+
+
+class _SyncResults(list):
+    def __init__(self, results, operations_sent, errors):
+        super().__init__(results)
+        self.operations_sent = operations_sent
+        self.errors = errors
+
+    def get_errors(self):
+        return iter(self.errors)
+
+
+class _SyncService:
+    """
+    Synchronous service answering every operation with its operand, `fail(operation, sends)` gives the errors of an
+    operation sent for the `sends`-th time
+    """
+    def __init__(self, service_name, mutates, fail):
+        self.service_name = service_name
+        self.mutates = mutates
+        self.fail = fail
+        self.sends = {}
+
+    def prepare_mutate(self, sync=None):
+        self.helper = self
+        self.operations = []
+
+    def add_operation(self, operation):
+        self.operations.append(operation)
+
+    def mutate(self, client_customer_id=None, sync=None):
+        self.mutates.append((self.service_name, client_customer_id, [_sync_name(op) for op in self.operations]))
+        results = []
+        errors = []
+        for operation in self.operations:
+            sends = self.sends[_sync_name(operation)] = self.sends.get(_sync_name(operation), 0) + 1
+            results.append({'client_id': client_customer_id, 'operand': operation['operand'], 'sends': sends})
+            errors.extend(dict(error, operation_failed=operation) for error in self.fail(operation, sends))
+        return _SyncResults(results, self.operations, errors)
+
+
+def _sync_name(operation):
+    return operation['operand'].get('name') or operation['operand']['criterion']['id']
+
+
+def _sync_client(fail=lambda operation, sends: [], **kwargs):
+    client = AdWords(**kwargs)
+    for n in range(6):
+        client.insert({'object_type': 'label', 'client_id': (1, 2, 3)[n % 3], 'label': 'l{}'.format(n)})
+    client.insert({'object_type': 'campaign_targeted_location', 'client_id': 1, 'campaign_id': 3,
+                   'location_id': 1001773})
+    mutates = []
+    client.service = lambda service_name: _SyncService(service_name, mutates, fail)
+    return client, mutates
+
+
+def test_sync_groups():
+    duplicate = {'ApiError.Type': 'LabelError', 'reason': 'DUPLICATE_NAME'}
+    client, mutates = _sync_client(lambda operation, sends: [duplicate] if _sync_name(operation) == 'l4' else [])
+    results, errors = client._sync_operations(max_workers=2, max_operations=1)
+    # results and errors in the order of the operations, whichever thread mutated them
+    assert [_sync_name(result) for result in results] == ['l0', 'l1', 'l2', 'l3', 'l4', 'l5', 1001773]
+    assert [result['client_id'] for result in results] == [1, 2, 3, 1, 2, 3, 1]
+    assert [(_sync_name(error['operation_failed']), error['reason']) for error in errors] == [('l4', 'DUPLICATE_NAME')]
+    # each group keeps its order
+    assert [names for service_name, client_id, names in mutates if client_id == 1] == [['l0'], ['l3'], [1001773]]
+    assert client._thread_pool is not None
+    with client.storage.open('sync_failures.deadletter', mode='r') as file:
+        dead_letters = [json.loads(line) for line in file]
+    assert [(dead_letter['client_id'], dead_letter['operation']['operand']['name']) for dead_letter in dead_letters] \
+        == [(2, 'l4')]
+
+    # a single group is mutated without threads
+    client = AdWords()
+    client.insert([{'object_type': 'label', 'client_id': 1, 'label': 'l{}'.format(n)} for n in range(3)])
+    mutates = []
+    client.service = lambda service_name: _SyncService(service_name, mutates, lambda operation, sends: [])
+    results, errors = client._sync_operations()
+    assert [_sync_name(result) for result in results] == ['l0', 'l1', 'l2'] and errors == []
+    assert mutates == [('LabelService', 1, ['l0', 'l1', 'l2'])]
+    assert client._thread_pool is None
+
+
+class _RecordingRetryPolicy(RetryPolicy):
+    """
+    Keeps the resend delays instead of waiting them
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delays = []
+
+    def get_resend_delay(self, api_errors, attempt):
+        self.delays.append(super().get_resend_delay(api_errors, attempt))
+        return 0
+
+
+def test_sync_resend():
+    rate_exceeded = {'ApiError.Type': 'RateExceededError', 'reason': 'RATE_EXCEEDED', 'retryAfterSeconds': 45}
+    concurrent = {'ApiError.Type': 'DatabaseError', 'reason': 'CONCURRENT_MODIFICATION'}
+    duplicate = {'ApiError.Type': 'LabelError', 'reason': 'DUPLICATE_NAME'}
+
+    def fail(operation, sends):
+        name = _sync_name(operation)
+        if name == 'l1' and sends == 1:
+            return [rate_exceeded]
+        return {'l2': [concurrent], 'l4': [duplicate]}.get(name, [])
+
+    policy = _RecordingRetryPolicy(max_attempts=3, base_delay=0)
+    client, mutates = _sync_client(fail, retry_policy=policy)
+    results, errors = client._sync_operations(max_workers=1)
+    # only the failed operations are sent again, rate exceeded ones after the delay asked by the server
+    assert [names for service_name, client_id, names in mutates if client_id == 2] == [['l1', 'l4'], ['l1']]
+    assert [names for service_name, client_id, names in mutates if client_id == 3] == [['l2', 'l5'], ['l2'], ['l2']]
+    assert policy.delays == [45, 0, 0]
+    # results of resent operations replace the failed ones
+    assert [(_sync_name(result), result['sends']) for result in results] == [
+        ('l0', 1), ('l1', 2), ('l2', 3), ('l3', 1), ('l4', 1), ('l5', 1), (1001773, 1)]
+    # errors of the last attempt, permanent ones and those of operations out of attempts are dead letters
+    assert [(_sync_name(error['operation_failed']), error['reason']) for error in errors] == [
+        ('l2', 'CONCURRENT_MODIFICATION'), ('l4', 'DUPLICATE_NAME')]
+    with client.storage.open('sync_failures.deadletter', mode='r') as file:
+        dead_letters = [json.loads(line) for line in file]
+    assert [(dead_letter['client_id'], dead_letter['operation']['operand']['name'],
+             [error['reason'] for error in dead_letter['errors']]) for dead_letter in dead_letters] == [
+        (3, 'l2', ['CONCURRENT_MODIFICATION']), (2, 'l4', ['DUPLICATE_NAME'])]
+    assert dead_letters[1] == {'client_id': 2, 'service_name': 'LabelService', 'operation': {
+        'xsi_type': 'LabelOperation', 'operator': 'ADD', 'operand': {'xsi_type': 'TextLabel', 'name': 'l4'}},
+        'errors': [{'type': 'LabelError', 'reason': 'DUPLICATE_NAME', 'field_path': None, 'trigger': None,
+                    'error_string': None}]}
+
+    client, mutates = _sync_client(fail, retry_policy=policy)
+    client.execute_operations(sync=True, dead_letter_file='failures/labels.deadletter')
+    with client.storage.open('failures/labels.deadletter', mode='r') as file:
+        assert [json.loads(line)['operation']['operand']['name'] for line in file] == ['l2', 'l4']
+
+
+def test_sync_failed_mutate():
+    def fail(operation, sends):
+        raise ConnectionResetError()
+
+    client, mutates = _sync_client(fail)
+    try:
+        client._sync_operations()
+    except ConnectionResetError:
+        pass
+    else:
+        assert False, 'the mutate error was not raised'
+    # the operations are still in the buffer, so they can be sent again
+    client.service = lambda service_name: _SyncService(service_name, mutates, lambda operation, sends: [])
+    results, errors = client._sync_operations()
+    assert len(results) == 7 and not errors
+
+
+def test_gunzip():
+    lines = ['{},campaña {},{}\n'.format(i, i, i * 1.5) for i in range(20000)]
+    text = ''.join(lines)
+    half = len(lines) // 2
+    data = gzip.compress(''.join(lines[:half]).encode('utf-8')) + gzip.compress(''.join(lines[half:]).encode('utf-8'))
+    assert utils.gunzip(BytesIO(data)).read() == text
+    chunks = [data[start:start + 1000] for start in range(0, len(data), 1000)]
+    with utils.gunzip(iter(chunks)) as stream:
+        assert list(stream) == lines
+    stream = BytesIO(data)
+    utils.gunzip(stream).close()
+    assert stream.closed
+
+
+def test_report_rows_close():
+    raw_report = StringIO('a\nb\n')
+    report = _ReportRows(raw_report, lambda: (line for line in raw_report))
+    # closing before the first row still closes the report
+    report.close()
+    assert raw_report.closed
+    raw_report = StringIO('a\nb\n')
+    assert list(_ReportRows(raw_report, lambda: (line for line in raw_report))) == ['a\n', 'b\n']
+    assert raw_report.closed
+
+
+def test_csv_reader_row_factories():
+    data = 'Ação,1,4.2\nb,2,\n'
+    fields = ['Name', 'Clicks', 'CpcBid']
+    converter = {'Clicks': int, 'CpcBid': lambda value: float(value) if value else None}
+    rows = list(utils.csv_reader(StringIO(data), fields, converter=converter)())
+    assert rows == [OrderedDict([('Name', 'Ação'), ('Clicks', 1), ('CpcBid', 4.2)]),
+                    OrderedDict([('Name', 'b'), ('Clicks', 2), ('CpcBid', None)])]
+    rows = list(utils.csv_reader(StringIO(data), fields, converter=converter, row_factory='namedtuple')())
+    assert rows[0].CpcBid == 4.2 and rows[1].Name == 'b'
+    assert rows[0]._asdict() == OrderedDict([('Name', 'Ação'), ('Clicks', 1), ('CpcBid', 4.2)])
+    assert list(utils.csv_reader(StringIO(data), fields, row_factory='tuple')()) == [('Ação', '1', '4.2'),
+                                                                                   ('b', '2', '')]
+
+
+def test_report_columns():
+    fields = ['CampaignName', 'Clicks', 'Cost']
+    columns = utils.ReportColumns(fields, {'Clicks': 'Long', 'Cost': 'Money'})
+    rows = [('a', 1, 0.5), ('b', 2, 1.25), ('a', 3, 0.0)]
+    columns.extend(iter(rows), batch_size=2)
+    assert len(columns) == 3
+    assert list(columns) == rows
+    assert columns['Clicks'] == array('q', [1, 2, 3])
+    assert columns['Cost'] == array('d', [0.5, 1.25, 0.0])
+    assert columns['CampaignName'].values == ['a', 'b']
+    assert list(columns['CampaignName']) == ['a', 'b', 'a']
+    if utils.numpy is not None:
+        assert columns.to_numpy('Cost').sum() == 1.75
+        assert list(columns.to_numpy('CampaignName')) == ['a', 'b', 'a']